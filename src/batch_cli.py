@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Compute many shifted bottleneck distances, streaming.
+
+Each input line is a JSON instance, {"A": [[birth, death], ...], "B": ...}
+(optionally with "A_mult", "B_mult" and an "id" to copy to the output).
+With --store, each input line is instead a pair of indices "i j" into a
+diagram store (see `diagram_store`).  Each output line is a JSON object
+with the input line number and the distance, or an error message.
+
+With --cache, results are looked up in and saved to a `result_cache` file.
+With --diagram-cache-points, each worker keeps the per-diagram work (see
+`diagram_cache`) for diagrams that come up again, up to that many distinct
+points; with --store, diagrams are found in it by index.
+
+With --trace-dir, every distance is computed with a `sweep_trace.SweepTrace`,
+and the traces of those that take at least --trace-slower-than seconds
+are saved there, named by input line, for `sweep_trace.py` to look at.
+
+Input is read as results are written, and no more than --max-pending lines
+are in flight at once, so memory use doesn't grow with the size of the job.
+If a worker process dies (e.g. it runs out of memory on a pathological pair),
+the lines it was working on are reported as errors.
+
+    python batch_cli.py jobs.jsonl --workers 8 -o results.jsonl
+    python batch_cli.py pairs.txt --store library.sbd --unordered
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import diagram_cache
+import diagram_store
+import main_algorithm as main
+import result_cache
+import sweep_trace
+
+# Set in each worker process by `_init_worker`.
+_worker_algorithm = None
+_worker_store = None
+_worker_cache = None
+_worker_trace_dir = None
+_worker_trace_slower_than = 0
+_worker_diagram_cache = None
+_worker_started = None
+
+# How often (in seconds) to check for dead workers while waiting on results.
+_POLL_SECONDS = 1.0
+
+
+def _init_worker(algorithm, store_path, cache_path=None, trace_dir=None,
+                 trace_slower_than=0, diagram_cache_points=None, started=None):
+    global _worker_algorithm, _worker_store, _worker_cache
+    global _worker_trace_dir, _worker_trace_slower_than, _worker_diagram_cache
+    global _worker_started
+    _worker_algorithm = algorithm
+    _worker_store = None if store_path is None else diagram_store.DiagramStore(store_path)
+    _worker_cache = None if cache_path is None else result_cache.ResultCache(cache_path)
+    _worker_trace_dir = trace_dir
+    _worker_trace_slower_than = trace_slower_than
+    _worker_diagram_cache = (None if diagram_cache_points is None
+                             else diagram_cache.DiagramCache(max_points=diagram_cache_points))
+    _worker_started = started
+
+
+def _compute_line(line_number, text):
+    result = {"line": line_number}
+    try:
+        if _worker_store is not None:
+            i, j = (int(index) for index in text.split())
+            result.update(A=i, B=j)
+            A, B = _stored_diagram(i), _stored_diagram(j)
+        else:
+            instance = json.loads(text)
+            if "id" in instance:
+                result["id"] = instance["id"]
+            A = main.diagram_from_arrays(instance["A"], instance.get("A_mult"))
+            B = main.diagram_from_arrays(instance["B"], instance.get("B_mult"))
+            if _worker_diagram_cache is not None:
+                A, B = _worker_diagram_cache.prepare(A), _worker_diagram_cache.prepare(B)
+        trace = None if _worker_trace_dir is None else sweep_trace.SweepTrace()
+        start = time.perf_counter()
+        if _worker_cache is not None:
+            result["distance"] = _worker_cache.distance(A, B, _worker_algorithm, trace=trace)
+        else:
+            result["distance"] = float(main.ALGORITHMS[_worker_algorithm](A, B, trace=trace))
+        # The trace is empty if the distance came from the cache.
+        if (trace is not None and trace.buffer
+                and time.perf_counter() - start >= _worker_trace_slower_than):
+            result["trace"] = os.path.join(_worker_trace_dir,
+                                           "line-{}.sbdtrace".format(line_number))
+            trace.save(result["trace"])
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def _stored_diagram(index):
+    if _worker_diagram_cache is None:
+        return _worker_store[index]
+    return _worker_diagram_cache.prepare_keyed(index, lambda: _worker_store[index])
+
+
+def _compute_chunk(chunk, chunk_id=None):
+    if _worker_started is not None:
+        _worker_started.put((chunk_id, os.getpid()))
+    return [_compute_line(line_number, text) for line_number, text in chunk]
+
+
+def _failed_chunk(chunk):
+    return [{"line": line_number, "error": "worker process died"}
+            for line_number, _ in chunk]
+
+
+class _DeadWorkers:
+    """Finds the chunks that were being computed by a worker process that
+    has since died, and so will never finish.  Workers say which chunk
+    they're starting on `started`, a `multiprocessing.SimpleQueue`."""
+
+    def __init__(self, pool, started):
+        self.pool = pool
+        self.started = started
+        self.workers = {}  # chunk id: pid, for the unfinished chunks
+
+    def finished(self, chunk_id):
+        # Also keeps `started` from filling up and blocking the workers.
+        self._read()
+        self.workers.pop(chunk_id, None)
+
+    def lost(self, chunk_ids):
+        self._read()
+        alive = {process.pid for process in self.pool._pool if process.exitcode is None}
+        return [chunk_id for chunk_id in chunk_ids
+                if chunk_id in self.workers and self.workers[chunk_id] not in alive]
+
+    def _read(self):
+        while not self.started.empty():
+            chunk_id, pid = self.started.get()
+            self.workers[chunk_id] = pid
+
+
+def _chunks(lines, chunksize):
+    # (line number, text) pairs, in lists of `chunksize`, skipping blank lines
+    numbered = ((n, text) for n, text in enumerate(lines, 1) if text.strip())
+    while True:
+        chunk = list(itertools.islice(numbered, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _ordered_results(pool, chunks, max_chunks, dead_workers):
+    def finished(chunk_id, chunk, result):
+        while not result.ready():
+            result.wait(_POLL_SECONDS)
+            if not result.ready() and dead_workers.lost([chunk_id]):
+                dead_workers.finished(chunk_id)
+                return _failed_chunk(chunk)
+        dead_workers.finished(chunk_id)
+        return result.get()
+    pending = collections.deque()
+    for chunk_id, chunk in enumerate(chunks):
+        if len(pending) >= max_chunks:
+            yield from finished(*pending.popleft())
+        pending.append((chunk_id, chunk,
+                        pool.apply_async(_compute_chunk, (chunk, chunk_id))))
+    while pending:
+        yield from finished(*pending.popleft())
+
+
+def _unordered_results(pool, chunks, max_chunks, dead_workers):
+    done = queue.Queue()  # (chunk id, list of results or an exception)
+    in_flight = {}  # chunk id: chunk
+    def finished():
+        while True:
+            try:
+                chunk_id, results = done.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                lost = dead_workers.lost(in_flight)
+                if not lost:
+                    continue
+                chunk_id, results = lost[0], _failed_chunk(in_flight[lost[0]])
+            if chunk_id in in_flight:
+                break
+        del in_flight[chunk_id]
+        dead_workers.finished(chunk_id)
+        if isinstance(results, BaseException):
+            raise results
+        return results
+    for chunk_id, chunk in enumerate(chunks):
+        if len(in_flight) >= max_chunks:
+            yield from finished()
+        put = lambda results, chunk_id=chunk_id: done.put((chunk_id, results))
+        pool.apply_async(_compute_chunk, (chunk, chunk_id), callback=put,
+                         error_callback=put)
+        in_flight[chunk_id] = chunk
+    while in_flight:
+        yield from finished()
+
+
+def run(lines, out, algorithm="paper", store=None, workers=1, ordered=True,
+        max_pending=1024, chunksize=16, cache=None, trace_dir=None, trace_slower_than=0,
+        diagram_cache_points=None):
+    """Compute the distance for each of `lines`, writing JSON lines to `out`
+    as they're found.  `store` is the path of a diagram store, if the lines
+    are pairs of indices, and `cache` the path of a result cache.  Traces of
+    the distances that take at least `trace_slower_than` seconds are saved
+    in `trace_dir`, if it's given.  If `diagram_cache_points` is given, each
+    worker keeps a `diagram_cache.DiagramCache` of that size.  Returns the
+    number of lines that failed."""
+    if algorithm not in main.ALGORITHMS:
+        raise ValueError("unknown algorithm {!r}; choose from {}"
+                         .format(algorithm, ", ".join(sorted(main.ALGORITHMS))))
+    chunks = _chunks(lines, chunksize)
+    worker_args = (algorithm, store, cache, trace_dir, trace_slower_than,
+                   diagram_cache_points)
+    if workers == 1:
+        _init_worker(*worker_args)
+        results = itertools.chain.from_iterable(map(_compute_chunk, chunks))
+        pool = None
+    else:
+        started = multiprocessing.SimpleQueue()
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=worker_args + (started,))
+        max_chunks = max(1, max_pending // chunksize)
+        gather = _ordered_results if ordered else _unordered_results
+        results = gather(pool, chunks, max_chunks, _DeadWorkers(pool, started))
+    failures = 0
+    try:
+        for result in results:
+            failures += "error" in result
+            out.write(json.dumps(result) + "\n")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    out.flush()
+    return failures
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSON lines, or index pairs with --store (default: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="default: stdout")
+    parser.add_argument("--store", help="diagram store that index pairs refer to")
+    parser.add_argument("--cache", help="result cache to read and update")
+    parser.add_argument("--diagram-cache-points", type=int, metavar="POINTS",
+                        help="keep the per-diagram work for repeated diagrams in each "
+                             "worker, up to this many distinct points (default: don't)")
+    parser.add_argument("--algorithm", choices=sorted(main.ALGORITHMS), default="paper")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--unordered", action="store_true",
+                        help="write results as they finish, not in input order")
+    parser.add_argument("--max-pending", type=int, default=1024,
+                        help="most input lines to hold in memory at once")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="input lines sent to a worker at a time")
+    parser.add_argument("--trace-dir", help="directory to save traces of slow distances in")
+    parser.add_argument("--trace-slower-than", type=float, default=1.0, metavar="SECONDS",
+                        help="save traces of distances that take this long (default: 1)")
+    args = parser.parse_args(argv)
+    infile = sys.stdin if args.input == "-" else open(args.input, "r")
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        failures = run(infile, outfile, algorithm=args.algorithm, store=args.store,
+                       workers=args.workers, ordered=not args.unordered,
+                       max_pending=args.max_pending, chunksize=args.chunksize,
+                       cache=args.cache, trace_dir=args.trace_dir,
+                       trace_slower_than=args.trace_slower_than,
+                       diagram_cache_points=args.diagram_cache_points)
+    finally:
+        for f in (infile, outfile):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli(sys.argv[1:]))
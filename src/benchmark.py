@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the distance algorithms and the neighbor structures in
+`plane_util`.
+
+Diagrams come from seeded generators, so a run can be repeated exactly.
+Each neighbor structure is built over a diagram, then drained the way
+`GeometricBipartiteMatching.build_layer_subgraph` drains it: every query
+point repeatedly asks for a neighbor and deletes it, until none are left.
+Each distance algorithm is timed on pairs of diagrams of the same sizes.
+They're far slower than the neighbor structures (seconds at n=100, minutes
+at n=300, and the event queue alone holds n^2 edges), so two flags bound
+them.  --max-distance-size (default 100) skips the larger sizes.
+--distance-time-limit (default 60 seconds) runs each distance in a child
+process and kills it when it goes over.  That algorithm is then not run on
+larger pairs of the same kind.  Everything skipped is listed under "skipped"
+in the results, with the reason.  Distances on the larger sizes are opt-in:
+raise --max-distance-size, and pass --distance-time-limit 0 to lift the
+limit.
+
+Peak memory is measured with `tracemalloc`, in a second run so that it
+doesn't slow down the timings.  Every distance is computed from scratch in
+both runs: the prepared diagrams are only cached when a
+`diagram_cache.DiagramCache` is passed in, and none is.  The scaling
+exponent of a series is the slope of log(time) against log(n).
+
+    python benchmark.py --output new.json
+    python benchmark.py --max-distance-size 1000 --distance-time-limit 600
+    python benchmark.py --compare old.json new.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import main_algorithm
+import plane_util as pu
+
+SIZES = [10, 30, 100, 1000, 10000, 100000]
+MAX_DISTANCE_SIZE = 100
+DISTANCE_TIME_LIMIT = 60.0
+
+EFRAT_CLASSES = [pu.EfratTreeWithDiagonal, pu.EfratRangeTree, pu.GridEfratStructure]
+
+ALGORITHMS = {
+    "original": main_algorithm.shifted_bottleneck_distance,
+    "paper": main_algorithm.other_shifted_bottleneck_distance,
+}
+
+
+def uniform_diagram(n, rng, scale=100.0, max_persistence=10.0):
+    points = []
+    for _ in range(n):
+        birth = rng.uniform(0, scale)
+        points.append(pu.Point(birth, birth + rng.uniform(0, max_persistence)))
+    return points
+
+
+def clustered_diagram(n, rng, clusters=5, scale=100.0, spread=0.5,
+                      max_persistence=10.0):
+    centers = uniform_diagram(clusters, rng, scale=scale,
+                              max_persistence=max_persistence)
+    points = []
+    for _ in range(n):
+        x, y = rng.choice(centers)
+        x += rng.gauss(0, spread)
+        y += rng.gauss(0, spread)
+        points.append(pu.Point(x, max(x, y)))
+    return points
+
+
+def near_diagonal_diagram(n, rng, scale=100.0, mean_persistence=0.2):
+    # Mostly noise: a few points far from the diagonal, most very close to it.
+    points = []
+    for _ in range(n):
+        birth = rng.uniform(0, scale)
+        points.append(pu.Point(birth, birth + rng.expovariate(1 / mean_persistence)))
+    return points
+
+
+def high_multiplicity_diagram(n, rng, distinct=10, **kwargs):
+    # n points, but only `distinct` different ones.
+    choices = uniform_diagram(min(n, distinct), rng, **kwargs)
+    return [rng.choice(choices) for _ in range(n)]
+
+
+GENERATORS = {
+    "uniform": uniform_diagram,
+    "clustered": clustered_diagram,
+    "near_diagonal": near_diagonal_diagram,
+    "high_multiplicity": high_multiplicity_diagram,
+}
+
+
+def shifted_copy_pair(n, rng, shift=25.0, noise=0.5):
+    # B is A moved along the diagonal, plus noise: the distance is small, but
+    # only at a shift far from 0.
+    A = uniform_diagram(n, rng)
+    B = []
+    for x, y in A:
+        x += shift + rng.gauss(0, noise)
+        y += shift + rng.gauss(0, noise)
+        B.append(pu.Point(x, max(x, y)))
+    return A, B
+
+
+def diagram_pair(name, n, rng):
+    # Two independent diagrams from GENERATORS[name], or a shifted copy.
+    if name == "shifted_copy":
+        return shifted_copy_pair(n, rng)
+    return GENERATORS[name](n, rng), GENERATORS[name](n, rng)
+
+
+PAIRS = sorted(GENERATORS) + ["shifted_copy"]
+
+
+def drain(efrat, queries):
+    # Returns the number of neighbors found.
+    found = 0
+    for point in queries:
+        neighbor = efrat.neighbor(point)
+        while neighbor is not None:
+            found += 1
+            efrat.delete(neighbor)
+            neighbor = efrat.neighbor(point)
+    return found
+
+
+def time_efrat(efrat_cls, points, queries, radius):
+    start = time.perf_counter()
+    efrat = efrat_cls(*points, diag_key=pu.B_DIAG, other_diag=pu.A_DIAG,
+                      radius=radius, closed=False)
+    built = time.perf_counter()
+    found = drain(efrat, queries)
+    drained = time.perf_counter()
+    return {"build": built - start, "drain": drained - built, "found": found}
+
+
+def peak_memory(func, *args):
+    # The most memory (in bytes) allocated at once while running func.
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare_efrats(sizes, seed=0, radius=1.0, efrat_classes=EFRAT_CLASSES,
+                   generators=sorted(GENERATORS), memory=False):
+    results = []
+    for name in generators:
+        for n in sizes:
+            rng = random.Random(seed)
+            points = GENERATORS[name](n, rng)
+            # Queries land near the diagram's points, as they do in the matching.
+            queries = [pu.Point(x + rng.gauss(0, radius), y + rng.gauss(0, radius))
+                       for x, y in points] + [pu.A_DIAG]
+            for efrat_cls in efrat_classes:
+                row = {"diagram": name, "n": n, "structure": efrat_cls.__name__}
+                row.update(time_efrat(efrat_cls, points, queries, radius))
+                if memory:
+                    row["peak_memory"] = peak_memory(time_efrat, efrat_cls, points,
+                                                     queries, radius)
+                results.append(row)
+    return results
+
+
+def time_distance(algorithm, A, B, memory=False, send=None):
+    # The distance, the time it took, and (if `memory`) the peak memory of a
+    # second run.  With `send`, each is sent as soon as it's known instead.
+    # No diagram cache is passed in, so the second run starts cold too.
+    distance = ALGORITHMS[algorithm]
+    start = time.perf_counter()
+    timing = (distance(A, B), time.perf_counter() - start)
+    if send is not None:
+        send(timing)
+    peak = peak_memory(distance, A, B) if memory else None
+    if send is not None:
+        send(peak)
+    return timing + (peak,)
+
+
+def time_distance_within(time_limit, algorithm, A, B, memory=False):
+    """`time_distance` in a child process, killed if a run takes longer than
+    `time_limit` seconds.  The parts that didn't finish are None."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=time_distance,
+                                    args=(algorithm, A, B, memory, sender.send))
+    child.start()
+    sender.close()
+    try:
+        timing = receiver.recv() if receiver.poll(time_limit) else (None, None)
+        peak = None
+        if memory and timing[1] is not None and receiver.poll(time_limit):
+            peak = receiver.recv()
+    finally:
+        child.terminate()
+        child.join()
+        receiver.close()
+    return timing + (peak,)
+
+
+def compare_algorithms(sizes, seed=0, algorithms=sorted(ALGORITHMS), pairs=PAIRS,
+                       memory=False, time_limit=None, skipped=None):
+    """Time each algorithm on each kind of pair, at each size.
+
+    If `time_limit` is given, each run is killed after that many seconds
+    (see `time_distance_within`), and the algorithm isn't run on the larger
+    pairs of the same kind.  If `skipped` is a list, the runs that were
+    killed or not started are appended to it.
+    """
+    results = []
+    for name in pairs:
+        too_slow = set()
+        for n in sorted(sizes):
+            A, B = diagram_pair(name, n, random.Random(seed))
+            for algorithm in algorithms:
+                seconds = None
+                if algorithm not in too_slow:
+                    if time_limit is None:
+                        distance, seconds, peak = time_distance(algorithm, A, B, memory)
+                    else:
+                        distance, seconds, peak = time_distance_within(time_limit, algorithm,
+                                                                       A, B, memory)
+                if seconds is None:
+                    too_slow.add(algorithm)
+                    if skipped is not None:
+                        skipped.append({"section": "distance", "diagram": name, "n": n,
+                                        "algorithm": algorithm, "reason": "time_limit"})
+                    continue
+                row = {"diagram": name, "n": n, "algorithm": algorithm,
+                       "distance": distance, "time": seconds}
+                if memory:
+                    # None if the memory run went over the time limit
+                    row["peak_memory"] = peak
+                    if peak is None:
+                        too_slow.add(algorithm)
+                results.append(row)
+    return results
+
+
+def scaling_exponent(sizes, values):
+    # Least-squares slope of log(value) against log(size), or None if there
+    # aren't two distinct sizes with positive values.
+    points = [(math.log(n), math.log(value))
+              for n, value in zip(sizes, values) if n > 0 and value > 0]
+    mean_x = sum(x for x, _ in points) / len(points) if points else 0
+    mean_y = sum(y for _, y in points) / len(points) if points else 0
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def scaling_exponents(rows, subject, measure):
+    # {"<diagram>/<subject>": exponent} for each series of rows
+    series = {}
+    for row in rows:
+        key = "{}/{}".format(row["diagram"], row[subject])
+        series.setdefault(key, []).append((row["n"], row[measure]))
+    return {key: scaling_exponent(*zip(*points))
+            for key, points in sorted(series.items())}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=SIZES, max_distance_size=MAX_DISTANCE_SIZE,
+        distance_time_limit=DISTANCE_TIME_LIMIT, seed=0, radius=1.0, memory=True):
+    """All the benchmarks, as a dict that can be saved as JSON.
+
+    The distance algorithms are run on every size up to `max_distance_size`
+    (all of them if it's None), subject to `distance_time_limit` (see
+    `compare_algorithms`).  What they weren't run on is listed under
+    "skipped".
+    """
+    efrat_rows = compare_efrats(sizes, seed=seed, radius=radius, memory=memory)
+    distance_sizes = [n for n in sizes if max_distance_size is None or n <= max_distance_size]
+    skipped = [{"section": "distance", "diagram": name, "n": n, "algorithm": algorithm,
+                "reason": "max_distance_size"}
+               for name in PAIRS for n in sorted(sizes) if n not in distance_sizes
+               for algorithm in sorted(ALGORITHMS)]
+    distance_rows = compare_algorithms(distance_sizes, seed=seed, memory=memory,
+                                       time_limit=distance_time_limit, skipped=skipped)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "seed": seed,
+        "radius": radius,
+        "max_distance_size": max_distance_size,
+        "distance_time_limit": distance_time_limit,
+        "efrat": efrat_rows,
+        "distance": distance_rows,
+        "skipped": skipped,
+        "scaling": {
+            "build": scaling_exponents(efrat_rows, "structure", "build"),
+            "drain": scaling_exponents(efrat_rows, "structure", "drain"),
+            "distance": scaling_exponents(distance_rows, "algorithm", "time"),
+        },
+    }
+
+
+MEASURES = {"efrat": ("structure", ("build", "drain")),
+            "distance": ("algorithm", ("time",))}
+
+
+def compare_results(old, new):
+    """(diagram, n, subject, measure, old time, new time) for each timing in
+    both sets of results."""
+    comparison = []
+    for section, (subject, measures) in MEASURES.items():
+        old_rows = {(row["diagram"], row["n"], row[subject]): row
+                    for row in old.get(section, [])}
+        for row in new.get(section, []):
+            key = (row["diagram"], row["n"], row[subject])
+            if key in old_rows:
+                comparison.extend(key + (measure, old_rows[key][measure], row[measure])
+                                  for measure in measures)
+    return comparison
+
+
+def _print_comparison(old_path, new_path):
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+    print("old: {}\nnew: {}".format(old.get("commit"), new.get("commit")))
+    print("{:<18} {:>7} {:<24} {:<6} {:>9} {:>9} {:>6}".format(
+        "diagram", "n", "subject", "", "old", "new", "ratio"))
+    for diagram, n, subject, measure, old_time, new_time in compare_results(old, new):
+        ratio = new_time / old_time if old_time else math.inf
+        print("{:<18} {:>7} {:<24} {:<6} {:>9.4f} {:>9.4f} {:>6.2f}".format(
+            diagram, n, subject, measure, old_time, new_time, ratio))
+
+
+def _print_results(results):
+    print("{:<18} {:>7} {:<24} {:>9} {:>9} {:>8}".format(
+        "diagram", "n", "structure", "build", "drain", "found"))
+    for row in results["efrat"]:
+        print("{diagram:<18} {n:>7} {structure:<24} {build:>9.4f} {drain:>9.4f} {found:>8}"
+              .format(**row))
+    print("\n{:<18} {:>7} {:<24} {:>9} {:>9}".format(
+        "diagram", "n", "algorithm", "time", "distance"))
+    for row in results["distance"]:
+        print("{diagram:<18} {n:>7} {algorithm:<24} {time:>9.4f} {distance:>9.4f}"
+              .format(**row))
+    for row in results["skipped"]:
+        print("{diagram:<18} {n:>7} {algorithm:<24} skipped ({reason})".format(**row))
+    print("\nscaling exponents")
+    for measure, exponents in results["scaling"].items():
+        for key, exponent in exponents.items():
+            if exponent is not None:
+                print("{:<8} {:<43} {:>6.2f}".format(measure, key, exponent))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--max-distance-size", type=int, default=MAX_DISTANCE_SIZE,
+                        help="largest diagrams to time the distance algorithms on "
+                             "(default: %(default)s)")
+    parser.add_argument("--distance-time-limit", type=float, metavar="SECONDS",
+                        default=DISTANCE_TIME_LIMIT,
+                        help="kill a distance run that takes longer than this, and skip "
+                             "the larger pairs of its kind; 0 for no limit "
+                             "(default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--radius", type=float, default=1.0)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip measuring peak memory")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two JSON files of results instead")
+    args = parser.parse_args()
+    if args.compare:
+        _print_comparison(*args.compare)
+        return
+    results = run(args.sizes, max_distance_size=args.max_distance_size,
+                  distance_time_limit=args.distance_time_limit or None, seed=args.seed,
+                  radius=args.radius, memory=not args.no_memory)
+    _print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
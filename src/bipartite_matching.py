@@ -1,4 +1,6 @@
 import abc
+import heapq
+import itertools
 import math
 import collections
 # from collections import Counter
@@ -23,6 +25,8 @@ class Matching:
         self.ctr = Counter()
         self.A_to_B = collections.defaultdict(set)
         self.B_to_A = collections.defaultdict(set)
+        # If this is a list, edges are appended to it when they first appear
+        self.new_edges = None
 
     def remove_edge(self, a, b):
         count = self.ctr[(a, b)]
@@ -49,17 +53,15 @@ class Matching:
         return sum(self.ctr.values())
 
     def _augment_edge(self, a, b, mult):
-        try:
-            self.ctr[(a, b)] += mult
-        except pu.NegativeCounterError:
-            #logger.error(f"Augmenting edge {(a, b)} by {mult} resulted in negative multiplicity {self.ctr[(a, b)]}!")
-            raise
+        self.ctr[(a, b)] += mult
         if self.ctr[(a, b)] == 0:
             self.remove_edge(a, b)
             # self.A_to_B[a].remove(b)
             # self.B_to_A[b].remove(a)
             # del self.ctr[(a, b)]
         else:
+            if self.new_edges is not None and self.ctr[(a, b)] == mult:
+                self.new_edges.append((a, b))
             self.A_to_B[a].add(b)
             self.B_to_A[b].add(a)
 
@@ -75,130 +77,108 @@ class Matching:
     def __iter__(self):
         yield from self.ctr.elements()
 
+def _size(diagram, counter):
+    # The number of points in `diagram`, counted in `counter`, unless it's a
+    # prepared diagram, which knows.
+    size = getattr(diagram, "size", None)
+    return sum(counter.values()) if size is None else size
+
 class GeometricBipartiteMatching:
     efrat_cls = pu.EfratTreeWithDiagonal
 
-    A_diag = "A_diag"
-    B_diag = "B_diag"
+    A_diag = pu.A_DIAG
+    B_diag = pu.B_DIAG
 
-    def __init__(self, A, B):
-        # A and B are collections.Counters full of points
-        #logger.info("New %s instance with A=%s and B=%s", type(self), A, B)
+    def __init__(self, A, B, stats=None):
+        # A and B are collections.Counters full of points, or
+        # `diagram_cache.PreparedDiagram`s.  `stats` is an optional
+        # `sweep_stats.SweepStats` to count our work in.
         self.A = Counter(A)
         self.B = Counter(B)
-        self.A[self.A_diag] = sum(self.B.values())
-        self.B[self.B_diag] = sum(self.A.values()) - self.A[self.A_diag]
+        A_size, B_size = _size(A, self.A), _size(B, self.B)
+        self.A[self.A_diag] = B_size
+        self.B[self.B_diag] = A_size
         self.A_exposed = Counter(self.A)
         self.B_exposed = Counter(self.B)
         self.matching = Matching()
         self._prev_path = None
+        self._B_efrat = None  # see `_B_neighbors`
+        self._length_index = None  # see `shrink_radius`
+        self.stats = stats
+        if stats is not None:
+            self.efrat_cls = stats.counting(self.efrat_cls)
 
     # def add_edge(source, dest, mult=1):
     #     pass  # edges will be totally implicit anyway
 
     def remove_all(self, edge):
-        #logger.info("remove_all called with edge=%s", edge)
-        # Remove all instances of the given edge
-        a, b = self._fix_diag_edge(edge)
-        assert a in self.A and b in self.B
+        # Remove all instances of the given edge.  The diagonal is named by
+        # `A_diag` and `B_diag`, never by a point on it.
+        a, b = edge
         count = self.matching.remove_edge(a, b)
         if count > 0:
             self.A_exposed[a] += count
             self.B_exposed[b] += count
 
-    def _fix_diag_edge(self, edge):
-        # Translate a diagonal edge to our representation, e.g.
-        # turn ((1.5, 1.5), (1, 2)) into (self.A_diag, (1, 2)).
-        def float_close(x, y):
-            return abs(x - y) < 0.0000000001
-        a, b = edge
-        if a != self.A_diag and float_close(*a):
-            a = self.A_diag
-        if b != self.B_diag and float_close(*b):
-            b = self.B_diag
-        return (a, b)
-
     def has_edge(self, a, b):
         return self.matching.has_edge(a, b)
 
+    def shrink_radius(self, radius, shift, closed=False):
+        """Drop the matched edges that are too long for the new radius at the
+        given shift, then re-augment from the vertices that were exposed.
+
+        The matched edges are kept in a heap by length at `shift`, which is
+        updated with the edges added since the last call.  So if the shift
+        doesn't change, the cost of dropping edges depends on how many
+        break, not on the size of the diagrams.
+        """
+        if self._length_index is None or self._length_index[0] != shift:
+            self.matching.new_edges = list(self.matching.ctr)
+            self._length_index = (shift, [], itertools.count())
+        _, heap, tiebreak = self._length_index
+        for a, b in self.matching.new_edges:
+            heapq.heappush(heap, (-self.edge_length(a, b, shift), next(tiebreak), a, b))
+        self.matching.new_edges = []
+        while heap and pu.closed_less_than(radius, -heap[0][0], closed=not closed):
+            _, _, a, b = heapq.heappop(heap)
+            # Entries for edges that have since left the matching are stale.
+            if self.matching.has_edge(a, b):
+                self.remove_all((a, b))
+        self.maximize_matching(radius, shift, closed=closed)
+
     def maximize_matching(self, radius, shift, closed=False):
-        #logger.info("maximize_matching called with radius=%s, shift=%s, closed=%s", radius, shift, closed)
+        if self.stats is not None:
+            self.stats.matchings += 1
         while True:
-            #logger.debug("loop asdf")
-            image, inverse_image = self._make_translation(shift)
-            # reverse_image = self._make_translation(-shift)
             # build a layer subgraph with pu.EfratTreeWithDiagonal
             layer_subgraph = self.build_layer_subgraph(radius, shift, closed=closed)
-            #logger.debug("A_exposed: %s", self.A_exposed)
-            #logger.debug("B_exposed: %s", self.B_exposed)
-            #logger.debug("Matching: %s", self.matching.ctr)
-            #logger.debug("Layer subgraph: %s", layer_subgraph)
             if not layer_subgraph[-1]:
-                #logger.debug("Fount nothing!")
                 # no augmenting paths were found
                 return
             else:
-                # do a binary search backward in the layer subgraph
-                # From here on, I got lazy and handled multiplicity badly
+                if self.stats is not None:
+                    self.stats.phases += 1
+                # do a depth-first search forward through the layer subgraph
                 even_layers = [layer for i, layer in enumerate(layer_subgraph)
                                if i % 2 == 0]
                 odd_layers = [layer for i, layer in enumerate(layer_subgraph)
                               if i % 2 == 1]
-                def image_of_ctr(ctr):
-                    return Counter({image(key): ctr[key] for key in ctr})
-                even_efrats = [self.efrat_cls(image_of_ctr(self.A_exposed),
-                                              radius=radius,
-                                              diag_key=self.A_diag, other_diag=self.B_diag,
-                                              closed=closed)]
-                even_efrats += [self.efrat_cls(image_of_ctr({x: self.A[x] for x in layer if x in self.A}),
-                                               radius=radius, diag_key=self.A_diag,
-                                               other_diag=self.B_diag,closed=closed)
-                                for layer in even_layers[1:]]
-                while True:
-                    #logger.debug("this loop awefoih")
-                    (aug_path, count) = self._dfs_layers(even_efrats, odd_layers, image, inverse_image)
-                    #logger.debug("awefoih %s", aug_path)
-                    if not aug_path:
-                        break
-                    else:
-                        assert count > 0
-                        self.matching.augment_path(*aug_path, mult=count)
-                        # Do some boring maintenance
-                        assert aug_path[0] in self.A_exposed
-                        assert aug_path[-1] in self.B_exposed
-                        self.A_exposed[aug_path[0]] -= count
-                        # if self.A_exposed[aug_path[0]] is 0:
-                        #     del self.A_exposed[aug_path[0]]
-                        self.B_exposed[aug_path[-1]] -= count
-                        # if self.B_exposed[aug_path[-1]] is 0:
-                        #     del self.B_exposed[aug_path[-1]]
-
-    def _make_translation(self, shift):
-        # The two errors we're avoiding here are:
-        #  - isinstance(inverse_image(image(pt)), pu.Point) but isinstance(pt, tuple)
-        #  - floating point error leading to infinite loops
-        inverse_dict = {}
-        def translate(a):
-            if a is self.A_diag or a is self.B_diag:
-                result = a
-            else:
-                result = pu.Point(*(coord + shift for coord in a))
-            inverse_dict[result] = a
-            return result
-        def undo_translate(pt):
-            if pt in inverse_dict:
-                return inverse_dict[pt]
-            else:
-                # maybe it's a tuple
-                return inverse_dict[pu.Point(*pt)]
-        return translate, undo_translate
+                # The odd layers hold points of B, and are searched from A
+                # with +shift, exactly as `build_layer_subgraph` searched
+                # them.  (Searching A from B with -shift instead can round
+                # differently for an edge right at the radius, and then the
+                # two disagree about which edges the layer subgraph has.)
+                odd_efrats = [self.efrat_cls(layer, radius=radius, diag_key=self.B_diag,
+                                             other_diag=self.A_diag, closed=closed)
+                              for layer in odd_layers]
+                even_layers = [Counter(self.A_exposed)] + [
+                    Counter({x: self.A[x] for x in layer if x in self.A})
+                    for layer in even_layers[1:]]
+                self._augment_blocking_flow(even_layers, odd_efrats, shift)
 
     def build_layer_subgraph(self, radius, shift, closed=False):
-        image, _ = self._make_translation(shift)
-
         layers = []
-        efrat = self.efrat_cls(*self.B.elements(), diag_key=self.B_diag,
-                               other_diag=self.A_diag, radius=radius, closed=closed)
+        efrat = self._B_neighbors(radius, closed)
         A_reached = set()  # reached doesn't need to be a Counter, since we don't
         # want cycles.  (We're looking for the *shortest* augmenting paths,
         # which will be simple.)
@@ -207,15 +187,14 @@ class GeometricBipartiteMatching:
         A_reached.update(layers[0])
         B_exposed_set = set(self.B_exposed)
         while True:
-            #logger.debug("this loop too!")
             # build odd layer
             odd_layer = Counter()
             for point in layers[-1]:
-                neighbor = efrat.neighbor(image(point))
+                neighbor = efrat.neighbor(point, shift=shift)
                 while neighbor is not None:
                     odd_layer[neighbor] += 1
                     efrat.delete(neighbor, mult=1)
-                    neighbor = efrat.neighbor(image(point))
+                    neighbor = efrat.neighbor(point, shift=shift)
             layers.append(odd_layer)
             # A_reached.update(odd_layer)
             if not odd_layer or B_exposed_set.intersection(set(odd_layer)):
@@ -238,98 +217,128 @@ class GeometricBipartiteMatching:
             layers.append(even_layer)
         # return layers
 
-    def _dfs_layers(self, even_efrats, odd_layers, image, inverse_image):
-        # While you are at a node, search from that node.  If you can reach another node,
-        # begin searching from that node.
-
-        # If you can't reach anything from your current node, delete it and backtrack.
-
-        # If you reach the end, determine the multiplicity of your path, and reduce the
-        # multiplicity of each node by that much.
-        # (TODO)
-        # Let's un-split these things, like a monster
+    def _B_neighbors(self, radius, closed):
+        # B never changes, so one neighbor structure over it serves every
+        # layer subgraph.  The deletions made while building the previous
+        # layer subgraph are rolled back instead of building a new one.
+        if self._B_efrat is None or type(self._B_efrat) is not self.efrat_cls:
+            self._B_efrat = self.efrat_cls(self.B, diag_key=self.B_diag,
+                                           other_diag=self.A_diag, radius=radius,
+                                           closed=closed)
+        else:
+            self._B_efrat.reset(radius=radius, closed=closed)
+        return self._B_efrat
+
+    def _augment_blocking_flow(self, even_layers, odd_efrats, shift):
+        # Augment along shortest augmenting paths until the layer subgraph has
+        # none left, i.e. find a blocking flow.  It's a depth-first search
+        # from the bottom (exposed A) layer up to the exposed B layer.  Each
+        # path carries as many copies as every node and matching edge on it
+        # allows.  After augmenting, we back up only as far as the first node
+        # or edge that was used up, and nodes that lead nowhere are deleted
+        # from their layers, so no dead end is explored twice.
         layers = []
-        assert len(even_efrats) == len(odd_layers)
-        for even_layer, odd_layer in zip(even_efrats, odd_layers):
+        assert len(even_layers) == len(odd_efrats)
+        for even_layer, odd_layer in zip(even_layers, odd_efrats):
             layers.append(even_layer)
             layers.append(odd_layer)
-        #logger.debug("Layers:  %s", layers)
-        # for node in layers[-1]:
-        layer = len(layers)
-        path = [None] * len(layers)
-        while layer > 0:
-            next_layer = layers[layer - 1]
-            assert path[layer - 1] is None
-            if not next_layer:
-                return (None, 0)
-            if layer == len(layers):
-                path[layer - 1] = next(iter(next_layer))
-                layer -= 1
+        top = len(layers)
+        path = [None] * top
+        partners = {}  # cursors for `_next_partner`
+        layer = 0  # the number of nodes on the path so far
+        while True:
+            if layer == top:
+                layer = self._augment_path_in_layers(path, layers)
+                continue
+            next_layer = layers[layer]
+            assert path[layer] is None
+            if layer == 0:
+                if not next_layer:
+                    return
+                path[0] = next(iter(next_layer))
+                layer += 1
             elif layer % 2:
-                assert path[layer] is not None
-                # we're searching from odd to even, so next_layer is an
+                # we're searching from even to odd, so next_layer is an
                 # efrat structure
                 assert isinstance(next_layer, pu.EfratNeighborStructure)
-                query_result = next_layer.neighbor(path[layer])
-                if query_result is not None:
-                    query_result = inverse_image(query_result)
-                path[layer - 1] = query_result
-                # print(f"reached {path[layer -1]} from {path[layer]} via efrat (search key: {reverse_image(path[layer])})")
-                # print(f"search key for (0, 0): {reverse_image((0, 0))}")
-                if path[layer - 1] is None:
+                query_result = next_layer.neighbor(path[layer - 1], shift=shift)
+                if query_result is None:
                     # delete the current node from the counter
-                    del layers[layer][path[layer]]
-                    path[layer] = None
-                    layer += 1
-                else:
+                    del layers[layer - 1][path[layer - 1]]
+                    path[layer - 1] = None
                     layer -= 1
+                else:
+                    path[layer] = query_result
+                    layer += 1
             else:
-                # searching from even to odd
-                assert path[layer] is not None
-                assert isinstance(next_layer, Counter)
-                next_nodes = self.matching.A_to_B[path[layer]].intersection(next_layer)
-                if next_nodes:
-                    path[layer-1] = next(iter(next_nodes))
-                    assert self.matching.count_edge(path[layer], path[layer-1]) > 0
+                # searching from odd to even, along matching edges
+                partner = self._next_partner(path[layer - 1], layer, layers, partners)
+                if partner is None:
+                    # delete all occurrences of this useless node
+                    layers[layer - 1].delete(path[layer - 1], mult=-1)
+                    path[layer - 1] = None
                     layer -= 1
                 else:
-                    # delete all occurrences of this useless node
-                    layers[layer].delete(image(path[layer]), mult=-1)
-                    path[layer] = None
+                    path[layer] = partner
                     layer += 1
 
-        def remove(node, layer, mult):
-            if isinstance(layer, pu.EfratNeighborStructure):
-                layer.delete(image(node), mult=mult)
-            else:
-                layer[node] -= mult
-                assert layer[node] >= 0
-                if layer[node] is 0:
-                    del layer[node]
-        # TODO multiplicity as on blackboard
-        # mult = self.A[path[0]] - self.matching.degree(path[0], in_A=True)
-        # mult = self.B[path[-1]] - min(mult, self.matching.degree(path[-1], in_A=False))
-        #logger.debug("Finding multiplicity of path %s", path)
-        mult = layers[0].count(image(path[0]))
-        #logger.debug("multiplicity of %s in %s: %s", path[0], layers[0], layers[0].count(image(path[0])))
-        mult = min(mult, layers[-1][path[-1]])
-        #logger.debug("multiplicities of endpoints: %s", mult)
+    def _next_partner(self, b, layer, layers, partners):
+        # A node of `layers[layer]` matched to `b`, or None.  The candidates
+        # are listed once per phase: augmenting only adds matching edges that
+        # go down the layers, never up.
+        key = (layer, b)
+        if key not in partners:
+            partners[key] = [a for a in self.matching.B_to_A[b] if a in layers[layer]]
+        candidates = partners[key]
+        while candidates:
+            a = candidates[-1]
+            if layers[layer][a] > 0 and self.matching.count_edge(a, b) > 0:
+                return a
+            candidates.pop()
+        return None
+
+    def _layer_count(self, node, index, layers):
+        if index % 2:
+            return layers[index].count(node)
+        else:
+            return layers[index][node]
+
+    def _augment_path_in_layers(self, path, layers):
+        # Augment along the complete path with as many copies as will fit,
+        # then return the number of nodes to keep on the path.
+        mult = min(self._layer_count(node, index, layers)
+                   for index, node in enumerate(path))
+        for index in range(2, len(path), 2):
+            mult = min(mult, self.matching.count_edge(path[index], path[index - 1]))
         assert mult > 0
-        for index in range(1, len(path) - 1, 2):
-            # if index % 2 == 1:
-                # print(path[index+1], path[index], self.matching.count_edge(path[index+1], path[index]))
-            mult = min(mult,
-                       self.matching.count_edge(path[index+1],
-                                                path[index]))
-        assert mult > 0  # again
-        # mult = min(get_multiplicity(node, index)
-        #            for index, node in enumerate(path))
-        # assert mult > 0
-        for node, layer in zip(path, layers):
-            remove(node, layer, mult)
-        #logger.debug("Augmenting: %s %s", path, mult)
-        #logger.debug("Modified layer subgraph: %s", layers)
-        return (path, mult)
+        self.matching.augment_path(*path, mult=mult)
+        if self.stats is not None:
+            self.stats.record_path(len(path) - 1)
+        # Do some boring maintenance
+        assert path[0] in self.A_exposed
+        assert path[-1] in self.B_exposed
+        self.A_exposed[path[0]] -= mult
+        self.B_exposed[path[-1]] -= mult
+        for index, node in enumerate(path):
+            if index % 2:
+                layers[index].delete(node, mult=mult)
+            else:
+                layers[index][node] -= mult
+                if layers[index][node] == 0:
+                    del layers[index][node]
+        # Keep the longest stretch from the bottom of the path that can still
+        # carry flow.
+        keep = 0
+        while keep < len(path):
+            if self._layer_count(path[keep], keep, layers) == 0:
+                break
+            if keep % 2 == 0 and keep and self.matching.count_edge(path[keep],
+                                                                    path[keep - 1]) == 0:
+                break
+            keep += 1
+        for index in range(keep, len(path)):
+            path[index] = None
+        return keep
 
     def diagonal_perfect(self):
         # "diagonal-perfect" is my word for a matching in which the degree of
@@ -343,6 +352,10 @@ class GeometricBipartiteMatching:
         else:
             yield from self.matching.ctr
 
+    def edge_counts(self):
+        # The edges and their multiplicities, as a new counter
+        return Counter({edge: self.matching.count_edge(*edge) for edge in self.edges()})
+
     def value(self, force=False):
         # The minimum, over all shifts, of the length of the longest edge in
         # `self.matching`
@@ -362,11 +375,11 @@ class GeometricBipartiteMatching:
         vee_bottom = None
         longest_diag_edge = 0
         for a, b in matching.ctr:
-            if a == cls.A_diag and b == cls.B_diag:
+            if a is cls.A_diag and b is cls.B_diag:
                 continue
-            elif a == cls.A_diag:
+            elif a is cls.A_diag:
                 longest_diag_edge = max(longest_diag_edge, pu.dist_from_diag(b))
-            elif b == cls.B_diag:
+            elif b is cls.B_diag:
                 longest_diag_edge = max(longest_diag_edge, pu.dist_from_diag(a))
             elif vee_bottom is None:
                 vee_bottom = edge_to_vee((a, b))
@@ -385,17 +398,19 @@ class GeometricBipartiteMatching:
         else:
             return max(longest_diag_edge, vee_bottom[1])
 
+    @classmethod
+    def edge_length(cls, a, b, shift=0):
+        if a is cls.A_diag and b is cls.B_diag:
+            return 0
+        if a is cls.A_diag:
+            return pu.dist_from_diag(b)
+        if b is cls.B_diag:
+            return pu.dist_from_diag(a)
+        return pu.infty_metric(pu.Point(*(coord + shift for coord in a)), b)
+
     @classmethod
     def matching_value_fixed_shift(cls, matching, shift=0):
-        def _dist(a, b, shift):
-            if a == cls.A_diag and b == cls.B_diag:
-                return 0
-            if a == cls.A_diag:
-                return pu.dist_from_diag(b)
-            if b == cls.B_diag:
-                return pu.dist_from_diag(a)
-            return pu.infty_metric(pu.Point(*(coord + shift for coord in a)), b)
-        return max(_dist(a, b, shift) for (a, b) in matching.ctr)
+        return max(cls.edge_length(a, b, shift) for (a, b) in matching.ctr)
 
 def intersect_diagonal_lines(downslope, upslope):
     # downslope is a point on the line with slope -1
@@ -405,7 +420,7 @@ def intersect_diagonal_lines(downslope, upslope):
     down_intercept = downslope[0] + downslope[1]
     up_intercept = upslope[0] - upslope[1]
     # now look halfway between them for the intersection
-    diff = (up_intercept - down_intercept) / 2
+    diff = pu.half(up_intercept - down_intercept)
     return pu.Point(down_intercept + diff, -diff)
 
 def edge_to_vee(edge):
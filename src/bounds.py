@@ -0,0 +1,95 @@
+"""
+Cheap bounds on the shifted bottleneck distance, and nearest-neighbor and
+range queries over a library of diagrams that use them to skip most of the
+exact computations.
+"""
+
+import heapq
+import itertools
+
+import bipartite_matching as bpm
+import main_algorithm as main
+import plane_util as pu
+
+
+def _by_height(diagram):
+    return sorted(pu.SaneCounter(diagram).elements(), key=pu.dist_from_diag,
+                  reverse=True)
+
+
+def lower_bound(A, B):
+    # Shifting a point along the diagonal doesn't change its distance from the
+    # diagonal, and `dist_from_diag` changes by at most the L-infinity
+    # distance between two points.  So any matching costs at least the
+    # bottleneck distance between the diagrams' multisets of heights.  In one
+    # dimension that's found by matching the heights in sorted order, with
+    # the shorter list padded with zeros (the diagonal).
+    heights_A = [pu.dist_from_diag(a) for a in _by_height(A)]
+    heights_B = [pu.dist_from_diag(b) for b in _by_height(B)]
+    return max((abs(h_a - h_b) for h_a, h_b in
+                itertools.zip_longest(heights_A, heights_B, fillvalue=0)),
+               default=0)
+
+
+def upper_bound(A, B):
+    # The value of a greedy matching: points paired off in order of height,
+    # with the leftovers sent to the diagonal.  Sending everything to the
+    # diagonal is also a matching, so we can't do worse than that.
+    A = _by_height(A)
+    B = _by_height(B)
+    if not A and not B:
+        return 0
+    matching = bpm.Matching()
+    for a, b in itertools.zip_longest(A, B):
+        matching.augment_path(bpm.GeometricBipartiteMatching.A_diag if a is None else a,
+                              bpm.GeometricBipartiteMatching.B_diag if b is None else b)
+    return min(bpm.GeometricBipartiteMatching.matching_value(matching),
+               max(pu.dist_from_diag(x) for x in A + B))
+
+
+def bounds(A, B):
+    """Return `(lower, upper)` bounds on the shifted bottleneck distance
+    between A and B, in O(n log n) time."""
+    return (lower_bound(A, B), upper_bound(A, B))
+
+
+def nearest_neighbors(query, library, k=1):
+    """The `k` diagrams in `library` closest to `query`, as a sorted list of
+    `(distance, index)` pairs."""
+    query = main.QueryDiagram(query)
+    library = list(library)
+    if not library:
+        return []
+    candidates = sorted((bounds(query.A, B), index) for index, B in enumerate(library))
+    # No more than k diagrams can be closer than the k-th smallest upper bound.
+    cutoff = heapq.nsmallest(k, (upper for (_, upper), _ in candidates))[-1]
+    best = []  # max-heap of (-distance, -index)
+    for (lower, upper), index in candidates:
+        if len(best) == k:
+            cutoff = min(cutoff, -best[0][0])
+        if lower > cutoff:
+            break  # candidates are sorted by lower bound
+        if lower == upper:
+            dist = lower
+        else:
+            dist = query.distance_to(library[index],
+                                     upper_bound=cutoff * (1 + main.epsilon) + main.epsilon)
+        if len(best) < k:
+            heapq.heappush(best, (-dist, -index))
+        elif dist < -best[0][0]:
+            heapq.heapreplace(best, (-dist, -index))
+    return sorted((-neg_dist, -neg_index) for neg_dist, neg_index in best)
+
+
+def within_radius(query, library, radius):
+    """Indices of the diagrams in `library` at distance less than `radius`
+    from `query`."""
+    query = main.QueryDiagram(query)
+    found = []
+    for index, B in enumerate(library):
+        lower, upper = bounds(query.A, B)
+        if lower >= radius:
+            continue
+        if upper < radius or query.distance_below(B, radius):
+            found.append(index)
+    return found
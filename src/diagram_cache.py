@@ -0,0 +1,160 @@
+"""
+The per-diagram work done before computing a distance (counting points,
+finding the farthest point from the diagonal, and sorting the edges to the
+diagonal), kept around for diagrams that come up in many pairs.
+
+`DiagramCache.prepare` returns a `PreparedDiagram`, reusing an earlier one
+for a diagram with the same contents, in any order.  That still means
+counting the diagram's points to look it up, so a caller that can name its
+diagrams (by their index in a `diagram_store`, say) should use
+`DiagramCache.prepare_keyed` instead, where a hit is one dict lookup and the
+diagram isn't even loaded.  Entries hold no reference to the caller's list or
+counter, only to the points.
+
+Nothing is cached unless a `DiagramCache` is passed in (as the `cache`
+argument of `main_algorithm.QueryDiagram`, or made by `batch_cli` and
+`distance_matrix` when asked to), so a long-running process only keeps the
+diagrams it asked to keep.  The cache holds at most `max_points` distinct
+points; past that, entries are evicted least recently used first
+(`policy="lru"`) or oldest first (`policy="fifo"`).
+
+A `PreparedDiagram` is a read-only mapping from points to multiplicities, so
+it can be passed anywhere a diagram can, and the distance functions use the
+work it holds instead of redoing it.
+"""
+
+import collections
+import collections.abc
+
+import event_queue
+import plane_util as pu
+
+
+class PreparedDiagram(collections.abc.Mapping):
+    """A diagram as a `SaneCounter`, with its number of points, its height
+    (farthest distance from the diagonal) and its sorted diagonal edges,
+    which are computed when first asked for."""
+
+    def __init__(self, diagram):
+        self.counter = pu.SaneCounter(diagram)
+        self.size = sum(self.counter.values())
+        self.height = max((pu.dist_from_diag(pt) for pt in self.counter), default=0)
+        self._diag_edges = {}
+        self._exact = None
+        self._denominator = None
+        self._scaled = None  # (scale, the scaled PreparedDiagram)
+        # In a scaled diagram, the original point of each point.
+        self.unscaled = None
+
+    def __len__(self):
+        # the number of distinct points
+        return len(self.counter)
+
+    def __getitem__(self, point):
+        return self.counter[point]
+
+    def __contains__(self, point):
+        return point in self.counter
+
+    def __iter__(self):
+        return iter(self.counter)
+
+    def diag_edges(self, in_A=True):
+        if in_A not in self._diag_edges:
+            self._diag_edges[in_A] = event_queue.sorted_diag_edges(self.counter, in_A=in_A)
+        return self._diag_edges[in_A]
+
+    def exact(self):
+        # The same diagram with `fractions.Fraction` coordinates.
+        if self._exact is None:
+            self._exact = PreparedDiagram(pu.exact_diagram(self.counter))
+        return self._exact
+
+    @property
+    def denominator(self):
+        # `pu.exact_denominator` of the diagram
+        if self._denominator is None:
+            self._denominator = pu.exact_denominator(self.counter)
+        return self._denominator
+
+    def scaled(self, scale):
+        # The same diagram with its coordinates multiplied by `scale`, as
+        # integers.  The last one asked for is kept.
+        if self._scaled is None or self._scaled[0] != scale:
+            unscaled = {pu.scaled_point(pt, scale): pt for pt in self.counter}
+            scaled = PreparedDiagram({point: self.counter[pt] for point, pt in unscaled.items()})
+            scaled.unscaled = unscaled
+            self._scaled = (scale, scaled)
+        return self._scaled[1]
+
+
+class DiagramCache:
+
+    POLICIES = ("lru", "fifo")
+
+    def __init__(self, max_points=1000000, policy="lru"):
+        if policy not in self.POLICIES:
+            raise ValueError("unknown eviction policy {!r}; choose from {}"
+                             .format(policy, ", ".join(self.POLICIES)))
+        self.max_points = max_points
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._points = 0
+
+    def prepare(self, diagram):
+        if isinstance(diagram, PreparedDiagram):
+            return diagram
+        # Count the points first: `diagram` may be an iterator, which can
+        # only be read once.
+        counter = pu.SaneCounter(diagram)
+        key = frozenset((pt, mult) for pt, mult in counter.items() if mult)
+        prepared = self._get(key)
+        if prepared is None:
+            prepared = self._put(key, PreparedDiagram(counter))
+        return prepared
+
+    def prepare_keyed(self, key, load):
+        """The diagram `load()` returns, prepared, and cached under `key`.
+        `load` is only called on a miss, so the key must stand for the
+        diagram's contents, and must not be a frozenset, which `prepare`
+        uses for its keys."""
+        prepared = self._get(key)
+        if prepared is None:
+            prepared = self._put(key, PreparedDiagram(load()))
+        return prepared
+
+    def _get(self, key):
+        prepared = self._entries.get(key)
+        if prepared is not None:
+            self.hits += 1
+            if self.policy == "lru":
+                self._entries.move_to_end(key)
+        return prepared
+
+    def _put(self, key, prepared):
+        self.misses += 1
+        if len(prepared) <= self.max_points:
+            self._entries[key] = prepared
+            self._points += len(prepared)
+            while self._points > self.max_points:
+                _, evicted = self._entries.popitem(last=False)
+                self._points -= len(evicted)
+        return prepared
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._points = 0
+
+
+def prepare(diagram, cache=None):
+    # `diagram` as a `PreparedDiagram`, from `cache` if one is given
+    if cache is not None:
+        return cache.prepare(diagram)
+    if isinstance(diagram, PreparedDiagram):
+        return diagram
+    return PreparedDiagram(diagram)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+A binary file holding many diagrams, which is opened with `mmap` so that any
+diagram can be read without parsing the rest.
+
+The layout, in native byte order:
+
+    header       magic, version, flags, number of diagrams, number of points
+    offsets      int64 * (diagrams + 1): diagram i is points offsets[i] to
+                 offsets[i + 1]
+    coords       float64 * (2 * points): birth, death, birth, death, ...
+    mults        int64 * points, only if the flags say so
+
+    python diagram_store.py library.sbd sample_instances/*.json
+"""
+
+import array
+import json
+import mmap
+import struct
+import sys
+
+import main_algorithm as main
+import plane_util as pu
+
+MAGIC = b"SBDSTORE"
+VERSION = 1
+HAS_MULTIPLICITIES = 1
+_HEADER = struct.Struct("=8sIIQQ")  # 32 bytes, so the arrays stay aligned
+
+
+class DiagramStoreError(ValueError):
+    pass
+
+
+def write_store(path, diagrams):
+    """Write an iterable of diagrams to `path`.  Repeated points are merged,
+    and multiplicities are only stored if some point is repeated."""
+    offsets = array.array('q', [0])
+    coords = array.array('d')
+    mults = array.array('q')
+    for diagram in diagrams:
+        for (birth, death), mult in pu.SaneCounter(diagram).items():
+            coords.append(birth)
+            coords.append(death)
+            mults.append(mult)
+        offsets.append(len(mults))
+    flags = HAS_MULTIPLICITIES if any(mult != 1 for mult in mults) else 0
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, flags, len(offsets) - 1, len(mults)))
+        offsets.tofile(f)
+        coords.tofile(f)
+        if flags & HAS_MULTIPLICITIES:
+            mults.tofile(f)
+
+
+class DiagramStore:
+    """A read-only view of a file written by `write_store`.
+
+    `store[i]` is the i-th diagram, as a multiset of points.  `raw(i)` gives
+    its coordinates and multiplicities as memoryviews into the file, without
+    copying anything.  A store can be pickled (e.g. sent to a worker
+    process); the copy maps the same file again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            if not f.seek(0, 2):
+                raise DiagramStoreError("{} is empty".format(self.path))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, flags, n_diagrams, n_points = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            self.close()
+            raise DiagramStoreError("{} is too short to be a diagram store".format(self.path))
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise DiagramStoreError("{} is not a version {} diagram store"
+                                    .format(self.path, VERSION))
+        sizes = [8 * (n_diagrams + 1), 16 * n_points]
+        if flags & HAS_MULTIPLICITIES:
+            sizes.append(8 * n_points)
+        if len(self._mmap) != _HEADER.size + sum(sizes):
+            self.close()
+            raise DiagramStoreError("{} is truncated or corrupt".format(self.path))
+        view = memoryview(self._mmap)
+        start = _HEADER.size
+        sections = []
+        for size, fmt in zip(sizes, "qdq"):
+            sections.append(view[start:start + size].cast(fmt))
+            start += size
+        self._offsets, self._coords = sections[:2]
+        self._mults = sections[2] if len(sections) == 3 else None
+        self._n_diagrams = n_diagrams
+
+    def close(self):
+        for name in ("_offsets", "_coords", "_mults"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views returned by `raw` are still alive.  The file stays
+            # mapped until they are garbage collected.
+            pass
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._open()
+
+    def __len__(self):
+        return self._n_diagrams
+
+    def raw(self, index):
+        """The coordinates (birth, death, birth, ...) and multiplicities (or
+        None, meaning all ones) of diagram `index`, as memoryviews."""
+        if not -self._n_diagrams <= index < self._n_diagrams:
+            raise IndexError("diagram index {} out of range".format(index))
+        index %= self._n_diagrams
+        lo, hi = self._offsets[index], self._offsets[index + 1]
+        mults = None if self._mults is None else self._mults[lo:hi]
+        return self._coords[2 * lo:2 * hi], mults
+
+    def __getitem__(self, index):
+        coords, mults = self.raw(index)
+        return main.diagram_from_arrays(zip(coords[::2], coords[1::2]), mults)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def json_to_store(json_paths, store_path):
+    """Convert JSON instances (as read by
+    `main_algorithm.weighted_instance_from_file`) to a store.  Each instance
+    becomes two diagrams, A then B."""
+    def diagrams():
+        for json_path in json_paths:
+            with open(json_path, "r") as f:
+                yield from main.weighted_instance_from_file(f)
+    write_store(store_path, diagrams())
+
+
+def store_to_json(store, index_A, index_B, file_):
+    """Write two diagrams from a store as a JSON instance."""
+    instance = {}
+    for key, index in (("A", index_A), ("B", index_B)):
+        diagram = store[index]
+        instance[key] = [list(pt) for pt in diagram]
+        instance[key + "_mult"] = list(diagram.values())
+    json.dump(instance, file_)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("usage: {} STORE INSTANCE.json...".format(sys.argv[0]))
+    json_to_store(sys.argv[2:], sys.argv[1])
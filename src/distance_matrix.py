@@ -0,0 +1,136 @@
+"""
+Pairwise shifted bottleneck distances between many diagrams.
+
+The pairs are farmed out to a process pool.  Each worker receives the list of
+diagrams once, when it starts, and after that only pairs of indices travel
+between processes.  The result is a condensed distance matrix: the upper
+triangle of the square matrix, row by row, as in `scipy.spatial.distance`.
+
+A partially computed matrix can be checkpointed to disk and resumed later.
+Entries that have not been computed yet are stored as NaN.
+
+Each diagram comes up in n - 1 pairs, so with `diagram_cache_points` each
+worker keeps the per-diagram work (see `diagram_cache`) in a cache of that
+many distinct points, keyed by the diagram's index.
+"""
+
+import array
+import math
+import multiprocessing
+import os
+
+import diagram_cache
+import main_algorithm as main
+import plane_util as pu
+
+# Set in each worker process by `_init_worker`.
+_worker_diagrams = None
+_worker_distance = None
+_worker_diagram_cache = None
+
+
+def condensed_size(n):
+    return n * (n - 1) // 2
+
+
+def condensed_index(i, j, n):
+    # Position of the (i, j) entry of an n-by-n distance matrix in its
+    # condensed form.
+    if i == j:
+        raise ValueError("diagonal entries are not stored: ({}, {})".format(i, j))
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def _pairs(n):
+    for i in range(n):
+        for j in range(i + 1, n):
+            yield (i, j)
+
+
+def _init_worker(diagrams, distance, diagram_cache_points=None):
+    global _worker_diagrams, _worker_distance, _worker_diagram_cache
+    _worker_diagrams = diagrams
+    _worker_distance = distance
+    _worker_diagram_cache = (None if diagram_cache_points is None
+                             else diagram_cache.DiagramCache(max_points=diagram_cache_points))
+
+
+def _diagram(index):
+    if _worker_diagram_cache is None:
+        return _worker_diagrams[index]
+    return _worker_diagram_cache.prepare_keyed(index, lambda: _worker_diagrams[index])
+
+
+def _compute_pair(pair):
+    i, j = pair
+    return (i, j, _worker_distance(_diagram(i), _diagram(j)))
+
+
+def load_checkpoint(path, n):
+    matrix = array.array('d')
+    with open(path, "rb") as f:
+        matrix.frombytes(f.read())
+    if len(matrix) != condensed_size(n):
+        raise ValueError("checkpoint {} holds {} entries, expected {} for {} diagrams"
+                         .format(path, len(matrix), condensed_size(n), n))
+    return matrix
+
+
+def save_checkpoint(path, matrix):
+    # Write to a temporary file first, so an interrupted save never clobbers
+    # the previous checkpoint.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        matrix.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def pairwise_distance_matrix(diagrams, workers=None, checkpoint=None,
+                             checkpoint_every=1000, chunksize=16,
+                             distance=main.other_shifted_bottleneck_distance,
+                             diagram_cache_points=None):
+    """Compute the condensed matrix of distances between all pairs of diagrams.
+
+    `workers` is the number of processes to use (default: one per CPU).  With
+    `workers=1` everything runs in the current process.  If `checkpoint` is
+    a path, finished entries are saved there every `checkpoint_every`
+    results, and any entries already saved there are not recomputed.
+    `distance` must be a module-level function so it can be pickled.  If
+    `diagram_cache_points` is given, it's handed `diagram_cache.PreparedDiagram`s
+    from each worker's cache of that size (see above).
+    """
+    diagrams = [pu.SaneCounter(diagram) for diagram in diagrams]
+    n = len(diagrams)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        matrix = load_checkpoint(checkpoint, n)
+    else:
+        matrix = array.array('d', [math.nan]) * condensed_size(n)
+    todo = [(i, j) for (i, j) in _pairs(n)
+            if math.isnan(matrix[condensed_index(i, j, n)])]
+    if not todo:
+        return matrix
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(diagrams, distance, diagram_cache_points)
+        results = map(_compute_pair, todo)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(diagrams, distance, diagram_cache_points))
+        results = pool.imap_unordered(_compute_pair, todo, chunksize=chunksize)
+    try:
+        for count, (i, j, dist) in enumerate(results, 1):
+            matrix[condensed_index(i, j, n)] = dist
+            if checkpoint is not None and count % checkpoint_every == 0:
+                save_checkpoint(checkpoint, matrix)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, matrix)
+    return matrix
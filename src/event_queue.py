@@ -1,7 +1,9 @@
 from collections import namedtuple
 
 import plane_util as pu
+import array
 import functools
+import heapq
 
 Edge = namedtuple("Edge", ("a", "b"))
 
@@ -17,7 +19,8 @@ class Event:
     pass
 
 def diag_edge_dist(edge):
-    return pu.infty_metric(*edge)
+    a, b = edge
+    return pu.dist_from_diag(b if a is pu.A_DIAG else a)
 
 class EntryEvent(Event):
     def __init__(self, edge, shift_to_check):
@@ -47,16 +50,31 @@ def print_return(func):
     # return _decorated
     return func
 
+def sorted_diag_edges(points, in_A=True):
+    # The edges from each point to the diagonal, longest first.
+    if in_A:
+        edges = [Edge(a, pu.B_DIAG) for a in points]
+    else:
+        edges = [Edge(pu.A_DIAG, b) for b in points]
+    return sorted(edges, key=lambda e: -diag_edge_dist(e))
+
+def diag_edge_stack(A, B, A_diag_edges=None, B_diag_edges=None):
+    # The sorted diagonal edges may be passed in if they're already known,
+    # as for a diagram that's compared against many others.
+    if A_diag_edges is None:
+        A_diag_edges = sorted_diag_edges(A, in_A=True)
+    if B_diag_edges is None:
+        B_diag_edges = sorted_diag_edges(B, in_A=False)
+    return Stack(list(heapq.merge(A_diag_edges, B_diag_edges,
+                                  key=lambda e: -diag_edge_dist(e))))
+
 class EventQueue:
-    def __init__(self, A, B):
+    def __init__(self, A, B, A_diag_edges=None, B_diag_edges=None):
         _a_b_edges = [Edge(a, b) for a in A for b in B]
         self._edge_entries = Stack(sorted(_a_b_edges, key=lambda e: birth(e, 0)))
         self._edge_exits = Stack(sorted(_a_b_edges, key=lambda e: death(e, 0)))
         # create a stack `diag_edges` containing all non-skew diagonal edges
-        self._diag_edges = Stack(sorted(
-            ([Edge(a, pu.closest_diag_point(a)) for a in A] +
-             [Edge(pu.closest_diag_point(b), b) for b in B]),
-            key=lambda e: -diag_edge_dist(e)))
+        self._diag_edges = diag_edge_stack(A, B, A_diag_edges, B_diag_edges)
 # pu.infty_metric(e.a, e.b)))
 
     def __bool__(self):
@@ -86,7 +104,7 @@ class EventQueue:
         right_end = death(self._edge_exits.top(), radius)
         if self._edge_entries:
             right_end = min(right_end, birth(self._edge_entries.top(), radius))
-        return EntryEvent(edge, (left_end + right_end) / 2)
+        return EntryEvent(edge, pu.half(left_end + right_end))
 
     def next_diagonal_height(self):
         if not self._diag_edges:
@@ -97,9 +115,126 @@ class EventQueue:
     def next_exit_shift(self, radius):
         return death(self._edge_exits.top(), radius)
 
+class ArrayEventQueue(EventQueue):
+    """An EventQueue that keeps the A-B edges as integer ids in flat arrays.
+
+    Edge `i * len(B) + j` joins `A[i]` to `B[j]`.  The births and deaths at
+    radius 0 are computed one row (one point of A) at a time, and the sorted
+    rows are merged, so no `Edge` objects exist until they are popped off the
+    queue, and at most one row's worth of Python numbers exists at once.  At
+    peak, while the exits are merged, there are about 32 bytes of arrays per
+    edge.  (In exact mode the coordinates are `Fraction`s, which don't fit in
+    an array, so the keys are Python objects after all.)
+    """
+    def __init__(self, A, B, A_diag_edges=None, B_diag_edges=None):
+        self._A = list(A)
+        self._B = list(B)
+        self._A_index = {a: i for i, a in enumerate(self._A)}
+        self._B_index = {b: j for j, b in enumerate(self._B)}
+        self._edge_entries = _EdgeIdStack(
+            _sorted_edge_ids(self._A, self._B, lambda dx, dy: max(dx, dy)), self)
+        self._edge_exits = _EdgeIdStack(
+            _sorted_edge_ids(self._A, self._B, lambda dx, dy: min(dx, dy)), self)
+        self._diag_edges = diag_edge_stack(self._A, self._B, A_diag_edges, B_diag_edges)
+
+    def _edge(self, edge_id):
+        i, j = divmod(edge_id, len(self._B))
+        return Edge(self._A[i], self._B[j])
+
+    def _edge_id(self, edge):
+        return self._A_index[edge.a] * len(self._B) + self._B_index[edge.b]
+
+def _sorted_edge_ids(A, B, key):
+    # The edge ids of `ArrayEventQueue`, as an array sorted by
+    # key(b.x - a.x, b.y - a.y), ties broken by id.  Each row is sorted on
+    # its own, and the rows are merged as (key, id) pairs.
+    rows = []
+    for i, (a_x, a_y) in enumerate(A):
+        row = [key(b_x - a_x, b_y - a_y) for b_x, b_y in B]
+        order = sorted(range(len(B)), key=row.__getitem__)
+        rows.append((pu.coordinate_array([row[j] for j in order]),
+                     array.array('q', [i * len(B) + j for j in order])))
+    merged = heapq.merge(*(zip(keys, ids) for keys, ids in rows))
+    return array.array('q', (edge_id for _, edge_id in merged))
+
+class LazyEventQueue(EventQueue):
+    """An EventQueue that generates the A-B edges as they are needed.
+
+    Only O(|A| + |B|) memory is used, instead of O(|A| * |B|), and edges that
+    the algorithm never reaches are never built.
+    """
+    def __init__(self, A, B, A_diag_edges=None, B_diag_edges=None):
+        A = list(A)
+        B = list(B)
+        self._edge_entries = MergedEdgeStream(A, B, exits=False)
+        self._edge_exits = MergedEdgeStream(A, B, exits=True)
+        self._diag_edges = diag_edge_stack(A, B, A_diag_edges, B_diag_edges)
+
+class MergedEdgeStream:
+    """The edges of A x B in order of `birth(e, 0)` (or `death(e, 0)` if
+    `exits`), produced lazily.  Supports the same operations as `Stack`.
+
+    Write t = a_x - a_y and d = b_x - b_y.  Then birth(e, 0) is b_x - a_x when
+    d >= t, and b_y - a_y otherwise.  (For death(e, 0) it's the other way
+    around.)  So for a fixed `a`, the edges split into two runs: one ordered
+    like B sorted by x, the other like B sorted by y.  We keep a cursor into
+    each run for each `a` and merge all of the runs with a heap.
+    """
+    def __init__(self, A, B, exits=False):
+        self._A = A
+        # run 0 walks `B` by x coordinate, run 1 walks it by y coordinate
+        self._runs = (sorted(B, key=lambda b: b[0]),
+                      sorted(B, key=lambda b: b[1]))
+        self._run_persistence = tuple([b[0] - b[1] for b in run] for run in self._runs)
+        self._exits = exits
+        self._heap = []
+        self._pushed = []
+        self._remaining = len(A) * len(B)
+        for i in range(len(A)):
+            for run in (0, 1):
+                self._advance(i, run, 0)
+
+    def _advance(self, i, run, cursor):
+        # Push the first edge at or after `cursor` in the given run for A[i].
+        a = self._A[i]
+        t = a[0] - a[1]
+        wants_upper = (run == 0) != self._exits  # does the run hold d >= t?
+        persistence = self._run_persistence[run]
+        while cursor < len(persistence) and (persistence[cursor] >= t) != wants_upper:
+            cursor += 1
+        if cursor < len(persistence):
+            b = self._runs[run][cursor]
+            heapq.heappush(self._heap, (b[run] - a[run], i, run, cursor, Edge(a, b)))
+
+    def pop(self):
+        self._remaining -= 1
+        if self._pushed:
+            return self._pushed.pop()
+        _, i, run, cursor, edge = heapq.heappop(self._heap)
+        self._advance(i, run, cursor + 1)
+        return edge
+
+    def push(self, edge):
+        self._remaining += 1
+        self._pushed.append(edge)
+
+    def top(self):
+        if self._pushed:
+            return self._pushed[-1]
+        return self._heap[0][-1]
+
+    def __len__(self):
+        return self._remaining
+
+    def __repr__(self):
+        return "{}({} edges)".format(type(self).__name__, len(self))
+
 class Stack:
     def __init__(self, items):
-        self.items = list(items[::-1])
+        if isinstance(items, array.array):
+            self.items = items[::-1]  # stay compact
+        else:
+            self.items = list(items[::-1])
 
     def pop(self):
         return self.items.pop()
@@ -121,3 +256,19 @@ class Stack:
 
     def __repr__(self):
         return repr(self.items)
+
+class _EdgeIdStack(Stack):
+    # A Stack of edge ids belonging to an ArrayEventQueue.  It hands out
+    # `Edge`s, so `EventQueue.next_event` works on it unchanged.
+    def __init__(self, edge_ids, queue):
+        super().__init__(edge_ids)
+        self.queue = queue
+
+    def pop(self):
+        return self.queue._edge(super().pop())
+
+    def push(self, edge):
+        super().push(self.queue._edge_id(edge))
+
+    def top(self):
+        return self.queue._edge(super().top())
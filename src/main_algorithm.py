@@ -8,12 +8,19 @@ that made it into the paper.
 
 from collections import namedtuple
 
-from bipartite_matching import GeometricBipartiteMatching
+from bipartite_matching import GeometricBipartiteMatching, edge_to_vee
 import plane_util as pu
+import diagram_cache
 import event_queue
 from event_queue import Edge, birth, death, Stack
+import sweep_stats
+import sweep_trace
 
+import fractions
+import itertools
 import json
+import math
+import warnings
 
 epsilon = 0.00000000001
 
@@ -24,27 +31,82 @@ epsilon = 0.00000000001
 def default_fudge(r):
     return r * (1 - epsilon)
 
+def no_fudge(r):
+    return r
+
 def upper_bound_on_radius(A, B):
     return max(pu.dist_from_diag(x) for x in A + B)
 
-def shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False):
+def _record_counts(stats, ctr, R_ctr, L_ctr, fail_ctr, win_ctr):
+    if stats is not None:
+        stats.events += ctr
+        stats.exit_events += R_ctr
+        stats.entry_events += L_ctr
+        stats.failed_entries += fail_ctr
+        stats.empty_entries += win_ctr
+
+def _analysis_stats(analysis, stats):
+    # `analysis=True` used to print some of the counts a `SweepStats` keeps.
+    # It still does, from a `SweepStats`, but callers should pass `stats`.
+    # Returns the stats to use and, if `analysis`, their counts so far.
+    if not analysis:
+        return stats, None
+    warnings.warn("analysis=True is deprecated; pass a sweep_stats.SweepStats as stats",
+                  DeprecationWarning, stacklevel=3)
+    if stats is None:
+        stats = sweep_stats.SweepStats()
+    return stats, stats.as_dict()
+
+def _print_analysis(stats, before, A, B, *label):
+    # The counts since `before`, in case `stats` was passed to earlier calls.
+    counts = {name: value - before[name] for name, value in stats.as_dict().items()}
+    print(*label, len(A) + len(B), "total", counts["events"], "R", counts["exit_events"],
+          "L", counts["entry_events"], "fail", counts["failed_entries"],
+          "win", counts["empty_entries"])
+
+def shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False, stats=None,
+                                trace=None):
     """Compute the shifted bottleneck distance between two diagrams, A and B (multisets).
 
+    If `stats` is a `sweep_stats.SweepStats`, it's filled in along the way,
+    and if `trace` is a `sweep_trace.SweepTrace`, every event is recorded in it.
+    `analysis` is deprecated: it prints a few of those counts.
+
     2021 note: this looks like an earlier version of the algorithm. Use the other version,
     defined below.
     """
+    stats, before = _analysis_stats(analysis, stats)
     A = pu.SaneCounter(A)
     B = pu.SaneCounter(B)
+    if trace is not None:
+        trace.begin("original", A, B, fudge, event_queue.EventQueue, epsilon)
     if not A and not B:
-        return 0
-    radius = fudge(upper_bound_on_radius(A, B))
-    events = event_queue.EventQueue(A, B)
-    matching = GeometricBipartiteMatching(A, B)
+        radius = 0
+    else:
+        radius = _original_distance(A, B, fudge, stats, trace)
+    if trace is not None:
+        trace.end(radius)
+    if analysis:
+        _print_analysis(stats, before, A, B)
+    return radius
+
+def _original_distance(A, B, fudge, stats, trace):
+    with sweep_stats.timer(stats, "setup"):
+        radius = fudge(upper_bound_on_radius(A, B))
+        events = event_queue.EventQueue(A, B)
+        matching = GeometricBipartiteMatching(A, B, stats=stats)
+    with sweep_stats.timer(stats, "sweep"):
+        radius = _original_sweep(radius, events, matching, fudge, stats, trace)
+    return radius
+
+def _original_sweep(radius, events, matching, fudge, stats, trace):
     # these counters are for performance monitoring only - they don't affect the logic
     ctr, R_ctr, L_ctr, fail_ctr, win_ctr = 0, 0, 0, 0, 0
     while events and radius > epsilon:
         ctr += 1
         event = events.next_event(radius)
+        if trace is not None:
+            trace.event(event, radius)
         if isinstance(event, event_queue.ExitEvent):
             R_ctr += 1
             matching.remove_all(event.edge)
@@ -62,30 +124,71 @@ def shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False):
                               - birth(event.edge, radius)) / 2))
                 events.push(event)
                 continue
-            matching.maximize_matching(
-                shift=event.shift_to_check,
-                radius=radius)
+            with sweep_stats.timer(stats, "matching"), \
+                    sweep_trace.matching(trace, matching, radius, event.shift_to_check):
+                matching.maximize_matching(
+                    shift=event.shift_to_check,
+                    radius=radius)
             if matching.diagonal_perfect():
                 radius = fudge(matching.value())
                 events.push(event)
-    if analysis:
-        print(len(A) + len(B), "total", ctr, "R", R_ctr, "L", L_ctr, "fail", fail_ctr, "win", win_ctr)
+    _record_counts(stats, ctr, R_ctr, L_ctr, fail_ctr, win_ctr)
     return radius
 
-def other_shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False):
-    """Compute the shifted bottleneck distance between two diagrams, A and B (multisets)"""
-    A = pu.SaneCounter(A)
-    B = pu.SaneCounter(B)
-    if not A and not B:
-        return 0
-    radius = fudge(upper_bound_on_radius(A, B))
-    events = event_queue.EventQueue(A, B)
-    matching = GeometricBipartiteMatching(A, B)
+def other_shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False,
+                                      queue_cls=event_queue.EventQueue, upper_bound=None,
+                                      exact=False, stats=None, trace=None, full_result=False):
+    """Compute the shifted bottleneck distance between two diagrams, A and B (multisets)
+
+    `queue_cls` may be `event_queue.ArrayEventQueue` or
+    `event_queue.LazyEventQueue`, which use much less memory on large diagrams.
+
+    If `upper_bound` is given, the search starts from that radius, and
+    `math.inf` is returned if the distance is not below it.
+
+    If `exact` is true, every tie is decided exactly and no fudge factor is
+    needed.  The coordinates are scaled to integers (see
+    `QueryDiagram._scale`), so the sweep is done in integer arithmetic, or
+    with `fractions.Fraction`s if the run is traced.  The result is an exact
+    `Fraction`.
+
+    If `stats` is a `sweep_stats.SweepStats`, it's filled in along the way,
+    and if `trace` is a `sweep_trace.SweepTrace`, every event is recorded in it.
+    `analysis` is deprecated: it prints a few of those counts.
+
+    If `full_result` is true, a `DistanceResult` is returned instead of just
+    the distance, with the shifts and the matching that achieve it.
+    """
+    stats, before = _analysis_stats(analysis, stats)
+    query = QueryDiagram(A, fudge=fudge, queue_cls=queue_cls, exact=exact)
+    if analysis:
+        B = diagram_cache.prepare(B)  # B may be an iterator
+    result = query.distance_to(B, upper_bound=upper_bound, stats=stats, trace=trace,
+                               full_result=full_result)
+    if analysis:
+        _print_analysis(stats, before, query.A, B, "other:")
+    return result
+
+def distance_below(A, B, threshold):
+    """Is the shifted bottleneck distance between A and B less than `threshold`?"""
+    return QueryDiagram(A).distance_below(B, threshold)
+
+def _other_sweep(A, B, radius, events, fudge, stop_at_first_match=False,
+                 min_radius=epsilon, stats=None, trace=None, keep_matching=False):
+    # The main loop of `other_shifted_bottleneck_distance`, starting from the
+    # given radius and event queue.  Returns the final radius, whether a
+    # diagonal-perfect matching was ever found, and (if `keep_matching`) a
+    # copy of the last one, which is no longer than the final radius.
+    matching = GeometricBipartiteMatching(A, B, stats=stats)
+    matched = False
+    kept = None
     # these counters are for performance monitoring only - they don't affect the logic
     ctr, R_ctr, L_ctr, fail_ctr, win_ctr = 0, 0, 0, 0, 0
-    while events and radius > epsilon:
+    while events and radius > min_radius:
         ctr += 1
         event = events.next_event(radius)
+        if trace is not None:
+            trace.event(event, radius)
         if isinstance(event, event_queue.ExitEvent):
             R_ctr += 1
             matching.remove_all(event.edge)
@@ -99,29 +202,339 @@ def other_shifted_bottleneck_distance(A, B, fudge=default_fudge, analysis=False)
                 fail_ctr += 1
                 radius = fudge(max(
                     events.next_diagonal_height(),
-                    radius - (events.next_exit_shift(radius)
-                              - birth(event.edge, radius)) / 2))
+                    radius - pu.half(events.next_exit_shift(radius)
+                                     - birth(event.edge, radius))))
+                # The matching's edges all last until the window closes at
+                # the new radius.
+                if keep_matching:
+                    kept = matching.edge_counts()
                 events.push(event)
                 continue
-            matching.maximize_matching(
-                shift=event.shift_to_check,
-                radius=radius)
+            with sweep_stats.timer(stats, "matching"), \
+                    sweep_trace.matching(trace, matching, radius, event.shift_to_check):
+                matching.maximize_matching(
+                    shift=event.shift_to_check,
+                    radius=radius)
             if matching.diagonal_perfect():
+                matched = True
+                if keep_matching:
+                    kept = matching.edge_counts()
+                if stop_at_first_match:
+                    break
                 # radius = fudge(matching.value())
                 events.push(event)
-    if analysis:
-        print("other:", len(A) + len(B), "total", ctr, "R", R_ctr, "L", L_ctr, "fail", fail_ctr, "win", win_ctr)
-    return radius
+    _record_counts(stats, ctr, R_ctr, L_ctr, fail_ctr, win_ctr)
+    return radius, matched, kept
+
+class QueryDiagram:
+    """A diagram prepared for computing its distance to many other diagrams.
+
+    The work that only depends on this diagram (counting its points, sorting
+    its diagonal edges, and finding its farthest point from the diagonal) is
+    done once, here, instead of once per distance.  If `cache` is a
+    `diagram_cache.DiagramCache`, the same work for the other diagrams is
+    kept there, in case they come up again.
+    """
+
+    def __init__(self, A, fudge=default_fudge, queue_cls=event_queue.EventQueue,
+                 exact=False, cache=None):
+        self.cache = cache
+        self.exact = exact
+        self._A = self._prepare(A)
+        self.A = self._A.counter
+        if exact:
+            self.fudge = no_fudge
+            self.min_radius = 0
+        else:
+            self.fudge = fudge
+            self.min_radius = epsilon
+        self.queue_cls = queue_cls
+
+    def distance_to(self, B, analysis=False, upper_bound=None, stats=None, trace=None,
+                    full_result=False):
+        """Same as `other_shifted_bottleneck_distance(self.A, B, upper_bound=upper_bound,
+        full_result=full_result)`."""
+        stats, before = _analysis_stats(analysis, stats)
+        B = self._prepare(B)
+        if trace is not None:
+            trace.begin(self._algorithm, self.A, B.counter, self.fudge, self.queue_cls,
+                        self.min_radius, bound=upper_bound)
+        distance, matching = self._distance_to(B, upper_bound, stats, trace, full_result)
+        if trace is not None:
+            trace.end(distance)
+        if analysis:
+            _print_analysis(stats, before, self.A, B.counter, "other:")
+        if full_result:
+            return DistanceResult(distance, matching, self.A, B.counter)
+        return distance
+
+    def _distance_to(self, B, upper_bound, stats, trace, keep_matching):
+        # The distance, and a matching that achieves it, if `keep_matching`
+        # and one was found.
+        if not self.A and not B.counter:
+            return (0 if upper_bound is None or upper_bound > 0 else math.inf), None
+        height = max(self._A.height, B.height)
+        if upper_bound is None or upper_bound >= height:
+            radius, _, matching = self._sweep(B, height, stats=stats, trace=trace,
+                                              keep_matching=keep_matching)
+            return radius, matching
+        radius, matched, matching = self._sweep(B, upper_bound, stats=stats, trace=trace,
+                                                keep_matching=keep_matching)
+        return (radius if matched else math.inf), matching
+
+    def distance_below(self, B, threshold, stats=None, trace=None):
+        """Is the distance to B less than `threshold`?  Stops as soon as the
+        answer is known."""
+        B = self._prepare(B)
+        if trace is not None:
+            trace.begin(self._algorithm, self.A, B.counter, self.fudge, self.queue_cls,
+                        self.min_radius, bound=threshold, below=True)
+        below = self._distance_below(B, threshold, stats, trace)
+        if trace is not None:
+            # the end record holds the answer, as 1 or 0
+            trace.end(below)
+        return below
+
+    def _distance_below(self, B, threshold, stats, trace):
+        if not self.A and not B.counter:
+            return threshold > 0
+        height = max(self._A.height, B.height)
+        if height < threshold:
+            return True
+        _, matched, _ = self._sweep(B, threshold, stop_at_first_match=True, stats=stats,
+                                    trace=trace)
+        return matched
+
+    @property
+    def _algorithm(self):
+        # the name in `ALGORITHMS`
+        return "exact" if self.exact else "paper"
+
+    def _prepare(self, diagram):
+        prepared = diagram_cache.prepare(diagram, self.cache)
+        return prepared.exact() if self.exact else prepared
+
+    def _scale(self, B):
+        # What to multiply the coordinates by for the exact sweep.  Four
+        # times a common denominator makes every coordinate a multiple of 4,
+        # so every vee's center and depth is even.  At an integer radius, the
+        # ends of every window then have the same parity as the radius, so
+        # the halves the sweep takes (a window's midpoint, or half the gap
+        # between two windows for the next radius) are integers, and so is
+        # the next radius.
+        return 4 * math.lcm(self._A.denominator, B.denominator)
+
+    def _sweep(self, B, radius, stop_at_first_match=False, stats=None, trace=None,
+               keep_matching=False):
+        # B is a `diagram_cache.PreparedDiagram`
+        A = self._A
+        scale = None
+        if self.exact:
+            radius = fractions.Fraction(radius)
+            # A trace records the caller's coordinates, so traced runs use
+            # fractions.
+            if trace is None:
+                scale = self._scale(B)
+        if scale is not None:
+            A, B = A.scaled(scale), B.scaled(scale)
+            # The distance is always a radius where two vees cross, which is
+            # an integer now, so a bound between two integers can be rounded
+            # up without changing the answer.
+            radius = math.ceil(radius * scale)
+        with sweep_stats.timer(stats, "setup"):
+            events = self.queue_cls(A.counter, B.counter,
+                                    A_diag_edges=A.diag_edges(in_A=True),
+                                    B_diag_edges=B.diag_edges(in_A=False))
+        with sweep_stats.timer(stats, "sweep"):
+            radius, matched, kept = _other_sweep(
+                A, B, self.fudge(radius), events, self.fudge,
+                stop_at_first_match=stop_at_first_match, min_radius=self.min_radius,
+                stats=stats, trace=trace, keep_matching=keep_matching)
+        if scale is not None:
+            radius = fractions.Fraction(radius) / scale
+            if kept is not None:
+                kept = type(kept)({(A.unscaled.get(a, a), B.unscaled.get(b, b)): count
+                                   for (a, b), count in kept.items()})
+        return radius, matched, kept
+
+    def distances_to(self, diagrams, upper_bound=None, stats=None):
+        """`distance_to` each of `diagrams`, in order, as a list.
+
+        `upper_bound` is a number, or a function that is called before each
+        diagram with the list of distances so far and returns the bound for
+        that diagram (or None).  A function lets a search tighten the bound
+        as it goes, to the k-th smallest distance so far, say.  Distances
+        that aren't below their bound are `math.inf`.  `stats` counts the
+        work for all the diagrams together.
+
+        Only the work for A is shared.  The event queue, matching and
+        neighbor structures are built over B's points (and the queue over
+        the pairs of A's and B's), so nothing in them carries over to the
+        next B.
+        """
+        distances = []
+        for B in diagrams:
+            bound = upper_bound(distances) if callable(upper_bound) else upper_bound
+            distances.append(self.distance_to(B, upper_bound=bound, stats=stats))
+        return distances
+
+
+class DistanceResult:
+    """The shifted bottleneck distance between A and B, with how it's
+    achieved.
+
+    `matching` is a counter of the matched pairs (a, b), with `pu.A_DIAG` or
+    `pu.B_DIAG` standing for the diagonal.  `shifts` is the interval
+    (low, high) of shifts of A at which no matched pair is farther apart
+    than the matching's value, which is the distance up to the fudge
+    factor.  If the distance is `math.inf` (it wasn't below the upper
+    bound), there is no matching and `shifts` is None.
+    """
+
+    def __init__(self, distance, matching, A, B):
+        self.distance = distance
+        if distance == math.inf:
+            self.matching = None
+            self.shifts = None
+            return
+        if matching is None:
+            # Nothing better was found than matching every point to the
+            # diagonal, which works at any shift.
+            matching = pu.SaneCounter({(a, pu.B_DIAG): mult for a, mult in A.items()})
+            matching.update({(pu.A_DIAG, b): mult for b, mult in B.items()})
+        matching.pop((pu.A_DIAG, pu.B_DIAG), None)
+        self.matching = matching
+        self.shifts = self._shift_interval(matching)
+
+    @staticmethod
+    def _shift_interval(matching):
+        # The length of a pair is a vee in the shift, |shift - center| + depth,
+        # so the longest pair at each shift is max(shift + M, P - shift)
+        # where M = max(depth - center) and P = max(depth + center).  Its
+        # lowest point is (P + M) / 2, unless a pair with the diagonal is
+        # longer than that.
+        vees = [edge_to_vee(edge) for edge in matching
+                if edge[0] is not pu.A_DIAG and edge[1] is not pu.B_DIAG]
+        value = max((pu.dist_from_diag(b if a is pu.A_DIAG else a)
+                     for a, b in matching if a is pu.A_DIAG or b is pu.B_DIAG), default=0)
+        if not vees:
+            return (-math.inf, math.inf)
+        M = max(depth - center for center, depth in vees)
+        P = max(depth + center for center, depth in vees)
+        value = max(value, (P + M) / 2)
+        low, high = P - value, value - M
+        if low > high:
+            # rounding error, when the vees set the value
+            low = high = (low + high) / 2
+        return (low, high)
 
+    @property
+    def shift(self):
+        # The shift in `shifts` closest to 0
+        low, high = self.shifts
+        return min(max(0, low), high)
+
+    def __repr__(self):
+        return "DistanceResult(distance={!r}, shifts={!r}, {} matched pairs)".format(
+            self.distance, self.shifts,
+            0 if self.matching is None else sum(self.matching.values()))
+
+
+def exact_shifted_bottleneck_distance(A, B, stats=None, trace=None):
+    return other_shifted_bottleneck_distance(A, B, exact=True, stats=stats, trace=trace)
+
+def bottleneck_distance(A, B, shift=0, stats=None):
+    """The ordinary (unshifted) bottleneck distance between A and B, after
+    moving A by `shift` along the diagonal.
+
+    This is a binary search over the possible values (the edge lengths at
+    `shift`) for the smallest radius with a diagonal-perfect matching.  The
+    matching is kept between probes: it's shrunk for a smaller radius and
+    extended for a larger one.  There is no event queue.
+    """
+    A = pu.SaneCounter(A)
+    B = pu.SaneCounter(B)
+    if not A and not B:
+        return 0
+    lengths = _candidate_lengths(A, B, shift)
+    matching = GeometricBipartiteMatching(A, B, stats=stats)
+    # Matching everything to the diagonal costs lengths[-1], so it's never
+    # probed.  After each probe, `high` is the smallest radius known to work.
+    low, high = 0, len(lengths) - 1
+    distance = lengths[-1]
+    radius = None
+    while low < high:
+        mid = (low + high) // 2
+        if radius is not None and lengths[mid] < radius:
+            matching.shrink_radius(lengths[mid], shift, closed=True)
+        else:
+            matching.maximize_matching(lengths[mid], shift, closed=True)
+        radius = lengths[mid]
+        if matching.diagonal_perfect():
+            high = mid
+            # the matching's own longest edge, in case the neighbor
+            # structures rounded differently
+            distance = matching.value_at_shift(shift)
+        else:
+            low = mid + 1
+    return distance
+
+def _candidate_lengths(A, B, shift):
+    # The sorted lengths of the edges at `shift` that are no longer than the
+    # edges to the diagonal, one of which is the bottleneck distance.
+    lengths = {pu.dist_from_diag(pt) for pt in itertools.chain(A, B)}
+    height = max(lengths)
+    edge_length = GeometricBipartiteMatching.edge_length
+    lengths.update(length for length in (edge_length(a, b, shift) for a in A for b in B)
+                   if length < height)
+    return sorted(lengths)
+
+# The implementations, by name, for command line tools.
+ALGORITHMS = {
+    "paper": other_shifted_bottleneck_distance,
+    "exact": exact_shifted_bottleneck_distance,
+    "original": shifted_bottleneck_distance,
+}
+
+def diagram_from_arrays(points, multiplicities=None):
+    """Build a diagram (a multiset of points) from a sequence of (birth,
+    death) pairs and, optionally, a parallel sequence of multiplicities.
+
+    Repeated pairs are merged as they're read, so a diagram with many copies
+    of each point costs memory per distinct point only.
+    """
+    diagram = pu.SaneCounter()
+    if multiplicities is None:
+        for pt in points:
+            diagram[pu.Point(*pt)] += 1
+        return diagram
+    points = list(points)
+    multiplicities = list(multiplicities)
+    if len(points) != len(multiplicities):
+        raise ValueError("got {} points but {} multiplicities"
+                         .format(len(points), len(multiplicities)))
+    for pt, mult in zip(points, multiplicities):
+        if mult < 0:
+            raise ValueError("negative multiplicity {} of {}".format(mult, pt))
+        if mult:
+            diagram[pu.Point(*pt)] += mult
+    return diagram
 
 def instance_from_file(file_):
+    # Two lists of points, with every copy of a repeated point listed.
+    A, B = weighted_instance_from_file(file_)
+    return list(A.elements()), list(B.elements())
 
+def weighted_instance_from_file(file_):
+    # The file holds a JSON object with lists of points "A" and "B", and
+    # optionally lists of their multiplicities "A_mult" and "B_mult".  The
+    # diagrams are returned as multisets (see `diagram_from_arrays`).
     instance = json.load(file_)
-    A = [pu.Point(*pt) for pt in instance['A']]
-    B = [pu.Point(*pt) for pt in instance['B']]
+    A = diagram_from_arrays(instance['A'], instance.get('A_mult'))
+    B = diagram_from_arrays(instance['B'], instance.get('B_mult'))
     return A, B
 
 if __name__ == "__main__":
     import sys
-    A, B = instance_from_file(sys.stdin)
-    print(shifted_bottleneck_distance(A, B))
+    A, B = weighted_instance_from_file(sys.stdin)
+    print(other_shifted_bottleneck_distance(A, B))
@@ -3,8 +3,11 @@
 """Here be dragons. Some of this stuff is used, and some was just for fun. Utility library."""
 
 import abc
+import array
+import bisect
 import functools
 import collections
+import fractions
 import math
 import random
 
@@ -26,15 +29,76 @@ class Point(tuple):
     def __new__(cls, *args):
         return tuple.__new__(cls, args)
 
+class DiagonalVertex:
+    """The diagonal, as a vertex of the matching graph.
+
+    There are exactly two of these, `A_DIAG` and `B_DIAG`, and they compare
+    by identity, so telling them apart from a point is cheap and exact.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+    def __reduce__(self):
+        # Unpickle to the same module-level object, keeping identity.
+        return self.name
+
+A_DIAG = DiagonalVertex("A_DIAG")
+B_DIAG = DiagonalVertex("B_DIAG")
+
+def exact_diagram(diagram):
+    # The same diagram with exact rational coordinates.  Every float is a
+    # rational number, so nothing is lost.
+    return SaneCounter({Point(*(fractions.Fraction(coord) for coord in pt)): count
+                        for pt, count in SaneCounter(diagram).items()})
+
+def exact_denominator(diagram):
+    # The least common multiple of the denominators of the coordinates, as
+    # fractions.
+    denominator = 1
+    for pt in diagram:
+        for coord in pt:
+            denominator = math.lcm(denominator, fractions.Fraction(coord).denominator)
+    return denominator
+
+def scaled_point(pt, scale):
+    # The point with its coordinates multiplied by `scale`, as integers.
+    # `scale` must be a multiple of their denominators.
+    return Point(*(int(fractions.Fraction(coord) * scale) for coord in pt))
+
+def half(value):
+    # value / 2, but an even integer stays an integer.  In exact mode the
+    # coordinates are scaled so that everything the sweep halves is even.
+    if type(value) is int and not value & 1:
+        return value >> 1
+    return value / 2
+
+_INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+def coordinate_array(values):
+    # A compact array of doubles or 64-bit integers, unless that would round
+    # some of the values (e.g. Fractions, in exact mode), in which case a
+    # plain list.
+    values = list(values)
+    if all(type(value) is float for value in values):
+        return array.array('d', values)
+    if all(type(value) is int and value in _INT64_RANGE for value in values):
+        return array.array('q', values)
+    return values
+
 def infty_metric(p1, p2):
     return max(abs(v1 - v2) for v1, v2 in zip(p1, p2))
 
 def dist_from_diag(pt):
     # (infinity norm, distance from diagonal x=y)
-    return abs(pt[0] - pt[1]) / 2
+    return half(abs(pt[0] - pt[1]))
 
 def closest_diag_point(pt):
-    coord = (pt[0] + pt[1]) / 2
+    coord = half(pt[0] + pt[1])
     return Point(coord, coord)
 
 def ccw(a, b, c):
@@ -51,10 +115,10 @@ def ccw(a, b, c):
 #       \ 1   1 /
 
 def to_northeast(point):
-    return (point[0] - point[1]) / 2
+    return half(point[0] - point[1])
 
 def to_northwest(point):
-    return (point[0] + point[1]) / 2
+    return half(point[0] + point[1])
 
 def to_diagonal(point):
     # [ 0.5  -0.5 ] [x]
@@ -197,6 +261,7 @@ class SimpleKDTree():
         else:
             self._empty = True
             self.count = 0
+        self._deleted_points = []  # only used at the root, by `restore_deleted`
 
     def _upward(self, point):
         # which side is the point on?  Up (1) or down (0)?
@@ -237,9 +302,9 @@ class SimpleKDTree():
                 return False
             result = child._delete(point, yell_if_absent)
             if result:
+                # Empty children are kept around (and skipped by searches),
+                # so that `restore_deleted` can bring them back.
                 self.count -= 1
-                if child.count is 0:
-                    self.children[side] = None
             # no way we need to yell here
             return result
 
@@ -262,11 +327,25 @@ class SimpleKDTree():
 
     def delete(self, point):
         self._delete(point, yell_if_absent=True)
+        self._deleted_points.append(point)
+
+    def restore_deleted(self):
+        # Undo every deletion since the tree was built (or last restored).
+        # Takes time proportional to the number of deletions, not the size
+        # of the tree.
+        for point in self._deleted_points:
+            node = self
+            while point != node.point:
+                node.count += 1
+                node = node.children[node._upward(point)]
+            node.count += 1
+            node.deleted = False
+        self._deleted_points = []
 
     def neighbors(self, point, radius, closed=True, want=-1, found=None):
         if found is None:
             found = []
-        if len(found) == want or self._empty:
+        if len(found) == want or self._empty or not self.count:
             return found
         if (not self.deleted and closed_less_than(
                 infty_metric(point, self.point), radius, closed)):
@@ -285,9 +364,11 @@ class SimpleKDTree():
         return found
                  
 
-    def neighbor(self, point, radius, closed=True):
-        if self._empty:
+    def neighbor(self, point, radius, closed=True, shift=0):
+        if self._empty or not self.count:
             return None
+        if shift:
+            point = (point[0] + shift, point[1] + shift)
         # return a neighbor of the point within the radius, if possible
         dist = infty_metric(point, self.point)
         if not self.deleted:
@@ -307,6 +388,324 @@ class SimpleKDTree():
             return self.children[not side].neighbor(point, radius, closed)
 
 
+class CompactKDTree:
+    """A 2-d tree stored implicitly in flat arrays.  Handles repeated points.
+
+    The points are permuted so that each subtree is a contiguous range of
+    positions, with the splitting point in the middle of the range.  Deleted
+    points are marked dead in a bitmap, and each range keeps a count of its
+    live points so that empty subtrees are skipped.  Searches use an explicit
+    stack, so there's no recursion limit to hit.
+    """
+
+    def __init__(self, *points):
+        n = len(points)
+        order = array.array('l', range(n))
+        coords = ([pt[0] for pt in points], [pt[1] for pt in points])
+        ranges = [(0, n, 0)]
+        while ranges:
+            lo, hi, dim = ranges.pop()
+            if hi - lo <= 1:
+                continue
+            # Partition the range in place around its median.  Sorting the
+            # slice happens in C, which beats a quickselect written in Python.
+            order[lo:hi] = array.array('l', sorted(order[lo:hi],
+                                                   key=coords[dim].__getitem__))
+            mid = (lo + hi) // 2
+            ranges.append((lo, mid, 1 - dim))
+            ranges.append((mid + 1, hi, 1 - dim))
+        self.points = [points[i] for i in order]
+        self.coords = tuple(coordinate_array(coord[i] for i in order)
+                            for coord in coords)
+        self.live = bytearray(b"\x01") * n
+        # live_counts[mid] is the number of live points in the range whose
+        # splitting point is at `mid`.
+        self.live_counts = array.array('l', [0]) * n
+        ranges = [(0, n)]
+        while ranges:
+            lo, hi = ranges.pop()
+            if lo < hi:
+                mid = (lo + hi) // 2
+                self.live_counts[mid] = hi - lo
+                ranges.append((lo, mid))
+                ranges.append((mid + 1, hi))
+        self._positions = collections.defaultdict(list)
+        for position in range(n - 1, -1, -1):
+            self._positions[self.points[position]].append(position)
+        self._deleted_positions = []
+
+    def __len__(self):
+        return self.live_counts[len(self.points) // 2] if self.points else 0
+
+    def __iter__(self):
+        return (pt for pt, live in zip(self.points, self.live) if live)
+
+    def __contains__(self, point):
+        return self.neighbor(point, 0, closed=True)
+
+    def _update_counts(self, position, change):
+        lo, hi = 0, len(self.points)
+        while True:
+            mid = (lo + hi) // 2
+            self.live_counts[mid] += change
+            if position == mid:
+                return
+            elif position < mid:
+                hi = mid
+            else:
+                lo = mid + 1
+
+    def delete(self, point):
+        positions = self._positions.get(point)
+        if not positions:
+            raise KeyError("Point {} not found for deletion".format(point))
+        position = positions.pop()
+        self.live[position] = 0
+        self._update_counts(position, -1)
+        self._deleted_positions.append(position)
+
+    def restore_deleted(self):
+        for position in self._deleted_positions:
+            self.live[position] = 1
+            self._update_counts(position, 1)
+            self._positions[self.points[position]].append(position)
+        self._deleted_positions = []
+
+    def neighbor(self, point, radius, closed=True, shift=0):
+        # return a live point within the radius of the given point, moved
+        # diagonally by `shift`, if any
+        query = (point[0] + shift, point[1] + shift)
+        xs, ys = self.coords
+        live, live_counts = self.live, self.live_counts
+        ranges = [(0, len(self.points), 0)]
+        while ranges:
+            lo, hi, dim = ranges.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if not live_counts[mid]:
+                continue
+            if live[mid] and closed_less_than(
+                    max(abs(query[0] - xs[mid]), abs(query[1] - ys[mid])),
+                    radius, closed):
+                return self.points[mid]
+            split = self.coords[dim][mid]
+            offset = query[dim] - split
+            # Points before `mid` have coordinates <= split, points after it
+            # >= split.  Search the side the query is on first.
+            lower = (lo, mid, 1 - dim) if closed_less_than(offset, radius, closed) else None
+            upper = (mid + 1, hi, 1 - dim) if closed_less_than(-offset, radius, closed) else None
+            for side in ((upper, lower) if offset < 0 else (lower, upper)):
+                if side is not None:
+                    ranges.append(side)
+        return None
+
+
+class HashGrid:
+    """Points bucketed into square cells whose side is the search radius.
+
+    A query then only looks in the 3x3 block of cells around the query
+    point, however the points are distributed.  Radius 0 buckets points by
+    their exact coordinates, and an infinite radius puts them all in one cell.
+    """
+
+    def __init__(self, points, cell_size):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(SaneCounter)
+        for pt in points:
+            self.cells[self._cell(pt)][pt] += 1
+        self._count = sum(sum(cell.values()) for cell in self.cells.values())
+        self._deleted_points = []
+        self._offsets = {}  # cell offsets to search, by reach
+
+    def _cell(self, point):
+        if self.cell_size == math.inf:
+            return ()
+        elif self.cell_size <= 0:
+            return (point[0], point[1])
+        else:
+            return (math.floor(point[0] / self.cell_size),
+                    math.floor(point[1] / self.cell_size))
+
+    def _nearby_cells(self, point, radius):
+        cell = self._cell(point)
+        if self.cell_size == math.inf or self.cell_size <= 0:
+            return [cell]
+        if radius == math.inf:
+            return list(self.cells)
+        reach = max(1, math.ceil(radius / self.cell_size))
+        if reach not in self._offsets:
+            # the cell containing `point` first: any point in it is a neighbor
+            self._offsets[reach] = sorted(((dx, dy) for dx in range(-reach, reach + 1)
+                                           for dy in range(-reach, reach + 1)),
+                                          key=lambda d: abs(d[0]) + abs(d[1]))
+        return [(cell[0] + dx, cell[1] + dy) for dx, dy in self._offsets[reach]]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for cell in self.cells.values():
+            yield from cell.elements()
+
+    def __contains__(self, point):
+        return self.neighbor(point, 0, closed=True)
+
+    def delete(self, point):
+        cell = self._cell(point)
+        if not self.cells.get(cell, {}).get(point):
+            raise KeyError("Point {} not found for deletion".format(point))
+        self.cells[cell][point] -= 1
+        if not self.cells[cell]:
+            del self.cells[cell]
+        self._count -= 1
+        self._deleted_points.append(point)
+
+    def restore_deleted(self):
+        for point in self._deleted_points:
+            self.cells[self._cell(point)][point] += 1
+        self._count += len(self._deleted_points)
+        self._deleted_points = []
+
+    def neighbor(self, point, radius, closed=True, shift=0):
+        # return a live point within the radius of the given point, moved
+        # diagonally by `shift`, if any
+        if shift:
+            point = (point[0] + shift, point[1] + shift)
+        for cell in self._nearby_cells(point, radius):
+            for pt in self.cells.get(cell, ()):
+                if closed_less_than(infty_metric(point, pt), radius, closed):
+                    return pt
+        return None
+
+
+def _find_live(next_live, index):
+    # Union-find over positions in a list, where deleted positions point
+    # further along.  Returns the first live position at or after `index`.
+    root = index
+    while next_live[root] != root:
+        root = next_live[root]
+    while next_live[index] != root:  # path compression
+        next_live[index], index = root, next_live[index]
+    return root
+
+
+class RangeTree:
+    """A 2-d range tree over the plane, for "is any live point in this
+    square?" queries, which is what L-infinity balls are.
+
+    The points are sorted by x, and every node of a segment tree over that
+    order keeps its points sorted by y.  A query visits O(log n) nodes and
+    does one binary search in each, then skips deleted entries using
+    union-find pointers.  Uses O(n log n) memory.
+    """
+
+    def __init__(self, *points):
+        order = sorted(range(len(points)), key=lambda i: points[i][0])
+        self.points = [points[i] for i in order]
+        self.xs = [pt[0] for pt in self.points]
+        self._size = len(self.points)
+        self._positions = collections.defaultdict(list)
+        for position in range(self._size - 1, -1, -1):
+            self._positions[self.points[position]].append(position)
+        # Node k covers the x-order positions [lo, hi) and has children 2k and
+        # 2k + 1, covering [lo, mid) and [mid, hi).
+        self._node_ys = {}
+        self._node_positions = {}
+        self._node_next_live = {}
+        nodes = [(1, 0, self._size)]
+        while nodes:
+            node, lo, hi = nodes.pop()
+            if lo >= hi:
+                continue
+            positions = sorted(range(lo, hi), key=lambda p: self.points[p][1])
+            self._node_positions[node] = array.array('l', positions)
+            self._node_ys[node] = [self.points[p][1] for p in positions]
+            self._node_next_live[node] = array.array('l', range(hi - lo + 1))
+            if hi - lo > 1:
+                mid = (lo + hi) // 2
+                nodes.append((2 * node, lo, mid))
+                nodes.append((2 * node + 1, mid, hi))
+        self._live_count = self._size
+        self._deleted_positions = []
+
+    def __len__(self):
+        return self._live_count
+
+    def __iter__(self):
+        deleted = set(self._deleted_positions)
+        return (pt for position, pt in enumerate(self.points) if position not in deleted)
+
+    def __contains__(self, point):
+        return self.neighbor(point, 0, closed=True)
+
+    def _nodes_containing(self, position):
+        node, lo, hi = 1, 0, self._size
+        while True:
+            yield node
+            if hi - lo == 1:
+                return
+            mid = (lo + hi) // 2
+            if position < mid:
+                node, hi = 2 * node, mid
+            else:
+                node, lo = 2 * node + 1, mid
+
+    def delete(self, point):
+        positions = self._positions.get(point)
+        if not positions:
+            raise KeyError("Point {} not found for deletion".format(point))
+        position = positions.pop()
+        y = point[1]
+        for node in self._nodes_containing(position):
+            node_positions = self._node_positions[node]
+            index = bisect.bisect_left(self._node_ys[node], y)
+            while node_positions[index] != position:
+                index += 1
+            self._node_next_live[node][index] = index + 1
+        self._live_count -= 1
+        self._deleted_positions.append(position)
+
+    def restore_deleted(self):
+        touched = set()
+        for position in self._deleted_positions:
+            touched.update(self._nodes_containing(position))
+            self._positions[self.points[position]].append(position)
+        for node in touched:
+            self._node_next_live[node] = array.array(
+                'l', range(len(self._node_positions[node]) + 1))
+        self._live_count = self._size
+        self._deleted_positions = []
+
+    def neighbor(self, point, radius, closed=True, shift=0):
+        # return a live point within the radius of the given point, moved
+        # diagonally by `shift`, if any
+        if not self._live_count:
+            return None
+        if closed:
+            lower, upper = bisect.bisect_left, bisect.bisect_right
+        else:
+            lower, upper = bisect.bisect_right, bisect.bisect_left
+        x, y = point[0] + shift, point[1] + shift
+        first = lower(self.xs, x - radius)
+        last = upper(self.xs, x + radius)
+        nodes = [(1, 0, self._size)]
+        while nodes:
+            node, lo, hi = nodes.pop()
+            if hi <= first or last <= lo:
+                continue
+            if first <= lo and hi <= last:
+                ys = self._node_ys[node]
+                index = _find_live(self._node_next_live[node], lower(ys, y - radius))
+                if index < len(ys) and closed_less_than(ys[index] - y, radius, closed):
+                    return self.points[self._node_positions[node][index]]
+            else:
+                mid = (lo + hi) // 2
+                nodes.append((2 * node + 1, mid, hi))
+                nodes.append((2 * node, lo, mid))
+        return None
+
+
 class EfratNeighborStructure(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
@@ -314,7 +713,9 @@ class EfratNeighborStructure(metaclass=abc.ABCMeta):
         raise NotImplementedError()
 
     @abc.abstractmethod
-    def neighbor(self, point):
+    def neighbor(self, point, shift=0):
+        # A point within the radius of `point + (shift, shift)`, or None.
+        # The diagonal is the same after any shift.
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -323,19 +724,28 @@ class EfratNeighborStructure(metaclass=abc.ABCMeta):
 
 
 class MultiEfratKDTree(EfratNeighborStructure):
-    kd_tree_cls = SimpleKDTree
+    kd_tree_cls = CompactKDTree
     def __init__(self, *ctr_args, closed=False, radius=math.inf):#, **ctr_kwargs):
         self.radius = radius
         self.closed = closed  # open or closed balls
         self.counter = self._ctr_from_args(*ctr_args)#  SaneCounter(ctr_args)#, **ctr_kwargs)
-        self.tree = self.kd_tree_cls(*self.counter.keys())
+        self.tree = self._make_tree(self.counter.keys())
+        self._deletions = []  # (point, mult) pairs, for `reset`
 
-    def neighbor(self, node):
-        return self.tree.neighbor(node, self.radius, closed=self.closed)
+    def _make_tree(self, points):
+        return self.kd_tree_cls(*points)
+
+    def neighbor(self, node, shift=0):
+        return self.tree.neighbor(node, self.radius, closed=self.closed, shift=shift)
 
     def _ctr_from_args(self, *args):
         if len(args) is 1 and isinstance(args[0], dict):
-            return SaneCounter(*args)
+            # Copied key by key, so zero counts are dropped (and negative
+            # ones rejected) as they would be for a list of points.
+            counter = SaneCounter()
+            for point, mult in args[0].items():
+                counter[point] = mult
+            return counter
         else:
             return SaneCounter(args)
 
@@ -343,6 +753,7 @@ class MultiEfratKDTree(EfratNeighborStructure):
         if mult < -1:
             raise ValueError("Invalid multiplicity {}: must be -1 or greater")
         if mult is -1:
+            self._deletions.append((point, self.counter[point]))
             del self.counter[point]
             self._delete_from_tree(point)
             return
@@ -353,6 +764,7 @@ class MultiEfratKDTree(EfratNeighborStructure):
             self.counter[point] += mult  # might as well fix it
             raise KeyError("Cannot remove {} of {}. Only {} remain"
                            .format(mult, point, self.counter[point]))
+        self._deletions.append((point, mult))
         if self.counter[point] is 0:
             self._delete_from_tree(point)
         #     del self.counter[point]
@@ -365,6 +777,18 @@ class MultiEfratKDTree(EfratNeighborStructure):
     def count(self, point):
         return self.counter[point]
 
+    def reset(self, radius=None, closed=None):
+        """Undo all deletions, and optionally change the radius or the
+        openness of the balls.  Much cheaper than building a new structure."""
+        if radius is not None:
+            self.radius = radius
+        if closed is not None:
+            self.closed = closed
+        for point, mult in self._deletions:
+            self.counter[point] += mult
+        self._deletions = []
+        self.tree.restore_deleted()
+
     def _delete_from_tree(self, point):
         self.tree.delete(point)
 
@@ -372,10 +796,12 @@ def closed_less_than(a, b, closed=True):
     return a <= b if closed else a < b
 
 class EfratTreeWithDiagonal(MultiEfratKDTree):
+    # `diag_key` and `other_diag` are tokens (e.g. `B_DIAG` and `A_DIAG`),
+    # recognized by identity.
     def __init__(self, *ctr_args, diag_key=None, other_diag=None, **kwargs):
         counter = self._ctr_from_args(*ctr_args)
         diag_count = counter.pop(diag_key) if diag_key in counter else 0
-        super().__init__(*counter.elements(), **kwargs)
+        super().__init__(counter, **kwargs)
         self.near_diagonal = set(pt for pt in self.counter
                                  if closed_less_than(dist_from_diag(pt),
                                                      self.radius,
@@ -386,13 +812,31 @@ class EfratTreeWithDiagonal(MultiEfratKDTree):
             self.counter[self.diag_key] = diag_count
             self.near_diagonal.add(diag_key)
 
-    def neighbor(self, point):
+    def _is_near_diagonal(self, point):
+        return (point is self.diag_key
+                or closed_less_than(dist_from_diag(point), self.radius,
+                                    closed=self.closed))
+
+    def reset(self, radius=None, closed=None):
+        if ((radius is None or radius == self.radius)
+                and (closed is None or closed == self.closed)):
+            restored = [point for point, _ in self._deletions
+                        if self.counter[point] == 0]
+            super().reset()
+            self.near_diagonal.update(point for point in restored
+                                      if self._is_near_diagonal(point))
+        else:
+            super().reset(radius=radius, closed=closed)
+            self.near_diagonal = set(pt for pt in self.counter
+                                     if self._is_near_diagonal(pt))
+
+    def neighbor(self, point, shift=0):
         if (self.counter[self.diag_key] > 0
-            and (point == self.other_diag
+            and (point is self.other_diag
                  or closed_less_than(dist_from_diag(point),
                                      self.radius, self.closed))):
             return self.diag_key
-        elif point == self.other_diag:
+        elif point is self.other_diag:
             # return an arbitrary point near the diagonal
             if self.near_diagonal:
                 # get an arbitrary point from self.near_diagonal
@@ -402,7 +846,7 @@ class EfratTreeWithDiagonal(MultiEfratKDTree):
             else:
                 return None
         else:
-            return super().neighbor(point)
+            return super().neighbor(point, shift=shift)
 
     def delete(self, point, mult=1):
         super().delete(point, mult=mult)
@@ -410,8 +854,77 @@ class EfratTreeWithDiagonal(MultiEfratKDTree):
             self.near_diagonal.remove(point)
 
     def _delete_from_tree(self, point):
-        if point != self.diag_key:
+        if point is not self.diag_key:
+            super()._delete_from_tree(point)
+
+    def __repr__(self):
+        return repr(self.counter).replace(type(self.counter).__name__, "Efrat")
+
+class EfratRangeTree(MultiEfratKDTree):
+    """Like `EfratTreeWithDiagonal`, but searches with a `RangeTree`.
+
+    Points near the diagonal are found in rotated coordinates: they're kept
+    sorted by `dist_from_diag`, so the live point nearest the diagonal is
+    always the first live entry.  Unlike `EfratTreeWithDiagonal.near_diagonal`,
+    this doesn't have to be rebuilt when the radius changes.
+    """
+    kd_tree_cls = RangeTree
+
+    def __init__(self, *ctr_args, diag_key=None, other_diag=None, **kwargs):
+        counter = self._ctr_from_args(*ctr_args)
+        diag_count = counter.pop(diag_key) if diag_key in counter else 0
+        super().__init__(counter, **kwargs)
+        self.diag_key = diag_key
+        self.other_diag = other_diag
+        if diag_count > 0:
+            self.counter[self.diag_key] = diag_count
+        self._by_height = sorted((pt for pt in self.counter if pt is not diag_key),
+                                 key=dist_from_diag)
+        self._height_index = {pt: index for index, pt in enumerate(self._by_height)}
+        self._next_live = array.array('l', range(len(self._by_height) + 1))
+
+    def neighbor(self, point, shift=0):
+        if (self.counter[self.diag_key] > 0
+            and (point is self.other_diag
+                 or closed_less_than(dist_from_diag(point),
+                                     self.radius, self.closed))):
+            return self.diag_key
+        elif point is self.other_diag:
+            index = _find_live(self._next_live, 0)
+            if (index < len(self._by_height)
+                    and closed_less_than(dist_from_diag(self._by_height[index]),
+                                         self.radius, self.closed)):
+                return self._by_height[index]
+            return None
+        else:
+            return super().neighbor(point, shift=shift)
+
+    def reset(self, radius=None, closed=None):
+        if self._deletions:
+            self._next_live = array.array('l', range(len(self._by_height) + 1))
+        super().reset(radius=radius, closed=closed)
+
+    def _delete_from_tree(self, point):
+        if point is not self.diag_key:
             super()._delete_from_tree(point)
+            index = self._height_index[point]
+            self._next_live[index] = index + 1
 
     def __repr__(self):
         return repr(self.counter).replace(type(self.counter).__name__, "Efrat")
+
+class GridEfratStructure(EfratTreeWithDiagonal):
+    """Like `EfratTreeWithDiagonal`, but searches with a `HashGrid` whose cells
+    are as wide as the radius.  Quick to build, with O(1) deletion, and
+    doesn't mind near-duplicate points.  Changing the radius in `reset`
+    rebuilds the grid.
+    """
+
+    def _make_tree(self, points):
+        return HashGrid(points, self.radius)
+
+    def reset(self, radius=None, closed=None):
+        rebuild = radius is not None and radius != self.radius
+        super().reset(radius=radius, closed=closed)
+        if rebuild:
+            self.tree = self._make_tree(pt for pt in self.counter if pt != self.diag_key)
@@ -0,0 +1,167 @@
+"""
+A cache of shifted bottleneck distances on disk, so that pairs of diagrams
+that come up again (in tomorrow's job, say) aren't recomputed.
+
+Entries are keyed by the contents of the two diagrams, not by their names:
+each diagram is hashed in a canonical form (distinct points in sorted order,
+with their multiplicities), and the pair's key combines the two hashes in
+sorted order, since the distance is symmetric.  The key also includes the
+algorithm's name and `ALGORITHM_VERSION`, so bumping the version retires
+every old entry.
+
+The cache is an SQLite file holding at most `max_entries` results.  When it
+overflows, the least recently used entries are evicted, down to `evict_to`
+of `max_entries`, so that eviction only runs once every so many inserts.
+The number of entries and the clock that orders their uses are kept in the
+file and updated in the same transaction as the entries, so several
+processes can share one cache.  Hits are written back in batches of
+`touch_batch` (and on every `put` and `close`) rather than one write
+transaction per hit; hits that are never written back only make the
+eviction order a little less exact.
+"""
+
+import fractions
+import hashlib
+import math
+import sqlite3
+
+import main_algorithm as main
+import plane_util as pu
+
+# Bump this when a change to the algorithms changes their results.
+ALGORITHM_VERSION = 1
+
+
+def _canonical_coord(coord):
+    # Equal numbers (2, 2.0, Fraction(2)) are written the same way, exactly.
+    return str(fractions.Fraction(coord))
+
+
+def diagram_hash(diagram):
+    """A hex digest of the multiset of points in `diagram`."""
+    digest = hashlib.sha256()
+    entries = sorted(pu.SaneCounter(diagram).items())
+    for (birth, death), mult in entries:
+        digest.update("{} {} {};".format(_canonical_coord(birth), _canonical_coord(death),
+                                         mult).encode())
+    return digest.hexdigest()
+
+
+def pair_key(A, B, algorithm="paper"):
+    hashes = sorted([diagram_hash(A), diagram_hash(B)])
+    return "{}/{}/{}/{}".format(algorithm, ALGORITHM_VERSION, *hashes)
+
+
+class ResultCache:
+    """Distances stored in the SQLite database at `path`.
+
+    `distance(A, B)` returns the cached result if there is one, and
+    otherwise computes it and stores it.  `hits` and `misses` count lookups
+    since the cache was opened.  Distances are stored as floats, whatever
+    the algorithm returned.
+    """
+
+    def __init__(self, path, max_entries=1000000, evict_to=0.9, touch_batch=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_to = evict_to
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._touched = []  # keys of hits not written back yet, oldest first
+        self._db = sqlite3.connect(path, timeout=60)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, distance REAL, last_used INTEGER)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_by_use "
+                             "ON results (last_used)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta "
+                             "(name TEXT PRIMARY KEY, value INTEGER)")
+            self._db.execute("INSERT OR IGNORE INTO meta "
+                             "SELECT 'clock', COALESCE(MAX(last_used), 0) FROM results")
+            self._db.execute("INSERT OR IGNORE INTO meta SELECT 'entries', COUNT(*) FROM results")
+
+    def _add_to(self, name, amount):
+        # Adds to a counter in the meta table, and returns its new value.
+        # Only call this inside a transaction: the UPDATE locks the file until
+        # it commits, so no other process can change the counter in between.
+        self._db.execute("UPDATE meta SET value = value + ? WHERE name = ?", (amount, name))
+        return self._db.execute("SELECT value FROM meta WHERE name = ?",
+                                (name,)).fetchone()[0]
+
+    def _tick(self, count=1):
+        # Reserves `count` consecutive times on the clock, for finding the
+        # least recently used entries, and returns the first of them.
+        return self._add_to("clock", count) - count + 1
+
+    def _write_touched(self):
+        # Records the uses of the entries hit since the last write.  Only
+        # call this inside a transaction.
+        if self._touched:
+            first = self._tick(len(self._touched))
+            self._db.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                 enumerate(self._touched, first))
+            self._touched = []
+
+    def close(self):
+        with self._db:
+            self._write_touched()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT value FROM meta WHERE name = 'entries'").fetchone()[0]
+
+    def get(self, key):
+        """The distance stored under `key`, or None."""
+        row = self._db.execute("SELECT distance FROM results WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append(key)
+        if len(self._touched) >= self.touch_batch:
+            with self._db:
+                self._write_touched()
+        return row[0]
+
+    def put(self, key, distance):
+        with self._db:
+            self._write_touched()
+            last_used = self._tick()
+            inserted = self._db.execute("INSERT OR IGNORE INTO results VALUES (?, ?, ?)",
+                                        (key, float(distance), last_used)).rowcount
+            if not inserted:
+                self._db.execute("UPDATE results SET distance = ?, last_used = ? WHERE key = ?",
+                                 (float(distance), last_used, key))
+                return
+            entries = self._add_to("entries", 1)
+            if entries > self.max_entries:
+                excess = entries - math.ceil(self.max_entries * self.evict_to)
+                evicted = self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                    "ORDER BY last_used LIMIT ?)", (excess,)).rowcount
+                self._add_to("entries", -evicted)
+
+    def distance(self, A, B, algorithm="paper", trace=None):
+        """The distance between A and B by the named algorithm (see
+        `main_algorithm.ALGORITHMS`), from the cache if possible.  `trace`
+        is passed on to the algorithm, if it has to be run."""
+        key = pair_key(A, B, algorithm)
+        distance = self.get(key)
+        if distance is None:
+            distance = float(main.ALGORITHMS[algorithm](A, B, trace=trace))
+            self.put(key, distance)
+        return distance
+
+    def clear(self):
+        self._touched = []
+        with self._db:
+            self._db.execute("DELETE FROM results")
+            self._db.execute("UPDATE meta SET value = 0 WHERE name = 'entries'")
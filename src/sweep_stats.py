@@ -0,0 +1,112 @@
+"""
+Counters and timers for one run of the distance algorithm, for finding out
+where the time goes on a bad input.
+
+Pass a `SweepStats` as the `stats` argument of
+`main_algorithm.other_shifted_bottleneck_distance` (or
+`shifted_bottleneck_distance`, or `QueryDiagram.distance_to`) and it's filled
+in as the algorithm runs.  Without one, nothing is counted: the neighbor
+structures are only wrapped in counting subclasses when there's somewhere to
+put the counts.
+"""
+
+import contextlib
+import time
+
+# Where the time goes.  "matching" is part of "sweep".
+PHASES = ("setup", "sweep", "matching")
+
+
+class SweepStats:
+
+    COUNTERS = (
+        "events",            # events taken off the queue
+        "exit_events",       # edges that left the graph
+        "entry_events",      # edges that joined it
+        "empty_entries",     # entry events with no shift to check
+        "failed_entries",    # entry events that made the radius smaller
+        "matchings",         # calls to maximize_matching
+        "phases",            # layer subgraphs that had augmenting paths
+        "augmenting_paths",
+        "path_edges",        # total length of the augmenting paths
+        "longest_path",      # in edges
+        "tree_builds",       # neighbor structures built
+        "tree_resets",       # ... and reused
+        "neighbor_queries",
+        "deletions",         # from neighbor structures
+    )
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.time = dict.fromkeys(PHASES, 0.0)
+        self._counting_classes = {}
+
+    def timer(self, phase):
+        return _Timer(self, phase)
+
+    def record_path(self, length):
+        self.augmenting_paths += 1
+        self.path_edges += length
+        self.longest_path = max(self.longest_path, length)
+
+    def counting(self, efrat_cls):
+        """A subclass of the neighbor structure class `efrat_cls` that counts
+        its builds, queries and deletions here."""
+        if efrat_cls not in self._counting_classes:
+            self._counting_classes[efrat_cls] = _counting_subclass(efrat_cls, self)
+        return self._counting_classes[efrat_cls]
+
+    def as_dict(self):
+        """The counters, and the time spent in each phase (in seconds) as
+        "time_<phase>", in one flat dict for exporting."""
+        result = {name: getattr(self, name) for name in self.COUNTERS}
+        result.update(("time_" + phase, seconds) for phase, seconds in self.time.items())
+        return result
+
+    def __repr__(self):
+        return "SweepStats({})".format(", ".join(
+            "{}={!r}".format(key, value) for key, value in self.as_dict().items()))
+
+
+def timer(stats, phase):
+    # Times the phase if `stats` isn't None.
+    return _NO_TIMER if stats is None else stats.timer(phase)
+
+_NO_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.time[self.phase] += time.perf_counter() - self.start
+
+
+def _counting_subclass(efrat_cls, stats):
+    class CountingEfrat(efrat_cls):
+
+        def __init__(self, *args, **kwargs):
+            stats.tree_builds += 1
+            super().__init__(*args, **kwargs)
+
+        def neighbor(self, point, shift=0):
+            stats.neighbor_queries += 1
+            return super().neighbor(point, shift=shift)
+
+        def delete(self, point, mult=1):
+            stats.deletions += 1
+            super().delete(point, mult=mult)
+
+        def reset(self, radius=None, closed=None):
+            stats.tree_resets += 1
+            super().reset(radius=radius, closed=closed)
+
+    CountingEfrat.__name__ = "Counting" + efrat_cls.__name__
+    return CountingEfrat
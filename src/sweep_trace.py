@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+A record of every event and every `maximize_matching` call in one run of
+the distance algorithm, for finding out why one pair is much slower than
+the rest.
+
+Pass a `SweepTrace` as the `trace` argument of
+`main_algorithm.other_shifted_bottleneck_distance` (or any of the
+`main_algorithm.ALGORITHMS`, or `QueryDiagram.distance_to`).  The trace is
+kept in memory, so it can be thrown away if the run turns out to be fast;
+`save` writes it to a file.  Without a trace, nothing is recorded.
+
+The file holds the two diagrams and the settings of the run (the fudge
+factor, the event queue class and the radius the sweep stops at), so
+`replay` can run the same computation again and check that it makes the
+same events in the same order.  Only the fudge factors in `FUDGE_NAMES` and
+the queue classes in `QUEUE_CLASSES` can be traced.
+
+Numbers that can't be written as float64 without rounding (the `Fraction`s
+of an exact run, or any integer coordinates) are written exactly, as text.
+The layout, little-endian:
+
+    header       magic, version, algorithm, below flag, fudge factor,
+                 queue class, min radius, exact flag
+    bound        a number (NaN, or empty, if none)
+    A, B         uint32 number of points, then (number birth, number death,
+                 int64 multiplicity) per point
+    records      a tag byte, then the record's fields; edges are a pair of
+                 indices into A and B, with -1 for the diagonal
+
+A number is a float64, or if the exact flag is set, a uint16 length and
+then that many bytes of ASCII, like "-7/3".  The records' radii and shifts
+are always float64: they're only compared with a replay's.
+
+    python sweep_trace.py summary slow.sbdtrace
+    python sweep_trace.py replay slow.sbdtrace
+"""
+
+import argparse
+import collections
+import contextlib
+import fractions
+import math
+import struct
+import sys
+import time
+
+import event_queue
+import plane_util as pu
+
+MAGIC = b"SBDTRACE"
+VERSION = 2
+# Only these can be replayed, by name (see `main_algorithm.ALGORITHMS`).
+ALGORITHM_NAMES = ("paper", "exact", "original")
+# The names of `main_algorithm.default_fudge` and `main_algorithm.no_fudge`
+FUDGE_NAMES = ("default_fudge", "no_fudge")
+QUEUE_CLASSES = (event_queue.EventQueue, event_queue.ArrayEventQueue,
+                 event_queue.LazyEventQueue)
+_HEADER = struct.Struct("<8sIB?BBd?")
+_COUNT = struct.Struct("<I")
+_FLOAT = struct.Struct("<d")
+_LENGTH = struct.Struct("<H")
+_MULT = struct.Struct("<q")
+
+ExitRecord = collections.namedtuple("ExitRecord", ("a", "b", "radius", "time"))
+EntryRecord = collections.namedtuple("EntryRecord", ("a", "b", "radius", "shift", "time"))
+MatchingRecord = collections.namedtuple(
+    "MatchingRecord", ("radius", "shift", "time", "duration", "perfect"))
+EndRecord = collections.namedtuple("EndRecord", ("distance", "time"))
+
+# tag byte -> (record type, struct of its fields)
+_RECORDS = {
+    b"X": (ExitRecord, struct.Struct("<iidd")),
+    b"N": (EntryRecord, struct.Struct("<iiddd")),
+    b"M": (MatchingRecord, struct.Struct("<dddd?")),
+    b"R": (EndRecord, struct.Struct("<dd")),
+}
+_TAGS = {record_type: (tag, record_struct)
+         for tag, (record_type, record_struct) in _RECORDS.items()}
+
+
+class SweepTraceError(ValueError):
+    pass
+
+
+class SweepTrace:
+    """A trace being recorded.  Times are in seconds since `begin`."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._start = None
+
+    def begin(self, algorithm, A, B, fudge, queue_cls, min_radius, bound=None,
+              below=False):
+        # Called by the algorithm with its diagrams, as multisets, and its
+        # settings.  `bound` is the upper bound or threshold it was given,
+        # and `below` is true for `distance_below`.
+        if algorithm not in ALGORITHM_NAMES:
+            raise ValueError("can't trace algorithm {!r}".format(algorithm))
+        import main_algorithm as main  # main_algorithm imports this module
+        fudges = [getattr(main, name) for name in FUDGE_NAMES]
+        if fudge not in fudges:
+            raise ValueError("can't trace a run with fudge factor {!r}".format(fudge))
+        if queue_cls not in QUEUE_CLASSES:
+            raise ValueError("can't trace a run with queue class {!r}".format(queue_cls))
+        numbers = [coord for diagram in (A, B) for point in diagram for coord in point]
+        if bound is not None:
+            numbers.append(bound)
+        exact = not all(type(number) is float for number in numbers)
+        del self.buffer[:]
+        self.buffer += _HEADER.pack(MAGIC, VERSION, ALGORITHM_NAMES.index(algorithm), below,
+                                    fudges.index(fudge),
+                                    QUEUE_CLASSES.index(queue_cls), min_radius, exact)
+        _write_number(self.buffer, bound, exact)
+        self._indices = []
+        for diagram in (A, B):
+            self.buffer += _COUNT.pack(len(diagram))
+            indices = {}
+            for point, mult in diagram.items():
+                indices[point] = len(indices)
+                _write_number(self.buffer, point[0], exact)
+                _write_number(self.buffer, point[1], exact)
+                self.buffer += _MULT.pack(mult)
+            self._indices.append(indices)
+        self._start = time.perf_counter()
+
+    def now(self):
+        return time.perf_counter() - self._start
+
+    def _append(self, record):
+        tag, record_struct = _TAGS[type(record)]
+        self.buffer += tag
+        self.buffer += record_struct.pack(*record)
+
+    def _edge(self, edge):
+        a, b = edge
+        return (-1 if a is pu.A_DIAG else self._indices[0][a],
+                -1 if b is pu.B_DIAG else self._indices[1][b])
+
+    def event(self, event, radius):
+        if isinstance(event, event_queue.ExitEvent):
+            self._append(ExitRecord(*self._edge(event.edge), float(radius), self.now()))
+        else:
+            self._append(EntryRecord(*self._edge(event.edge), float(radius),
+                                     float(event.shift_to_check), self.now()))
+
+    @contextlib.contextmanager
+    def matching(self, matching, radius, shift):
+        # Records a call to `matching.maximize_matching` made in the block.
+        start = self.now()
+        yield
+        self._append(MatchingRecord(float(radius), float(shift), start,
+                                    self.now() - start, matching.diagonal_perfect()))
+
+    def end(self, distance):
+        self._append(EndRecord(float(distance), self.now()))
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.buffer)
+
+
+def _write_number(buffer, number, exact):
+    # None is written as NaN, or as the empty string.
+    if not exact:
+        buffer += _FLOAT.pack(math.nan if number is None else number)
+        return
+    text = b"" if number is None else str(fractions.Fraction(number)).encode("ascii")
+    buffer += _LENGTH.pack(len(text))
+    buffer += text
+
+
+def _read_number(data, offset, exact):
+    # The number at `offset`, and the offset after it.
+    if not exact:
+        number, = _FLOAT.unpack_from(data, offset)
+        return (None if math.isnan(number) else number), offset + _FLOAT.size
+    length, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    text = bytes(data[offset:offset + length]).decode("ascii")
+    if len(text) != length:
+        raise struct.error("number cut short")
+    if not text:
+        return None, offset
+    # Integers are written without a denominator.
+    number = fractions.Fraction(text) if "/" in text else int(text)
+    return number, offset + length
+
+
+def matching(trace, matching, radius, shift):
+    # Records the block as a matching if `trace` isn't None.
+    return _NO_RECORD if trace is None else trace.matching(matching, radius, shift)
+
+_NO_RECORD = contextlib.nullcontext()
+
+
+class Trace:
+    """A trace read back from a file or buffer.  `A_points` and `B_points`
+    are (point, multiplicity) pairs, in the order the records' indices
+    refer to.  `fudge` is a name from `FUDGE_NAMES`."""
+
+    def __init__(self, data):
+        data = memoryview(data)
+        try:
+            magic, version, algorithm, self.below, fudge, queue_cls, self.min_radius, \
+                self.exact_numbers = _HEADER.unpack_from(data)
+        except struct.error:
+            raise SweepTraceError("too short to be a trace")
+        if magic != MAGIC or version != VERSION:
+            raise SweepTraceError("not a version {} trace".format(VERSION))
+        try:
+            self.algorithm = ALGORITHM_NAMES[algorithm]
+            self.fudge = FUDGE_NAMES[fudge]
+            self.queue_cls = QUEUE_CLASSES[queue_cls]
+        except IndexError:
+            raise SweepTraceError("unknown algorithm, fudge factor or queue class")
+        offset = _HEADER.size
+        try:
+            self.bound, offset = _read_number(data, offset, self.exact_numbers)
+            self.A_points, offset = self._read_diagram(data, offset)
+            self.B_points, offset = self._read_diagram(data, offset)
+            self.records = []
+            while offset < len(data):
+                record_type, record_struct = _RECORDS[bytes(data[offset:offset + 1])]
+                self.records.append(record_type(*record_struct.unpack_from(data, offset + 1)))
+                offset += 1 + record_struct.size
+        except (struct.error, KeyError, ValueError):
+            raise SweepTraceError("trace is truncated or corrupt at byte {}".format(offset))
+
+    def _read_diagram(self, data, offset):
+        count, = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        points = []
+        for _ in range(count):
+            birth, offset = _read_number(data, offset, self.exact_numbers)
+            death, offset = _read_number(data, offset, self.exact_numbers)
+            mult, = _MULT.unpack_from(data, offset)
+            offset += _MULT.size
+            points.append((pu.Point(birth, death), mult))
+        return points, offset
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    @property
+    def A(self):
+        return pu.SaneCounter(dict(self.A_points))
+
+    @property
+    def B(self):
+        return pu.SaneCounter(dict(self.B_points))
+
+    def edge(self, record):
+        # The edge of an exit or entry record, as points.
+        return event_queue.Edge(pu.A_DIAG if record.a == -1 else self.A_points[record.a][0],
+                                pu.B_DIAG if record.b == -1 else self.B_points[record.b][0])
+
+    @property
+    def distance(self):
+        if self.records and isinstance(self.records[-1], EndRecord):
+            return self.records[-1].distance
+        return None
+
+
+def summarize(trace):
+    """Where the time went, as a dict."""
+    counts = collections.Counter(type(record).__name__ for record in trace.records)
+    matchings = [record for record in trace.records if isinstance(record, MatchingRecord)]
+    total = trace.records[-1].time if trace.records else 0.0
+    matching_time = sum(record.duration for record in matchings)
+    return {
+        "algorithm": trace.algorithm,
+        "points": (sum(mult for _, mult in trace.A_points),
+                   sum(mult for _, mult in trace.B_points)),
+        "distance": trace.distance,
+        "exit_events": counts["ExitRecord"],
+        "entry_events": counts["EntryRecord"],
+        "matchings": len(matchings),
+        "perfect_matchings": sum(record.perfect for record in matchings),
+        "radii": len({record.radius for record in trace.records
+                      if not isinstance(record, EndRecord)}),
+        "time": total,
+        "matching_time": matching_time,
+        "event_time": total - matching_time,
+        "slowest_matchings": sorted(matchings, key=lambda record: -record.duration)[:5],
+    }
+
+
+def replay(trace):
+    """Run the traced computation again, with the same settings.  Returns
+    its own trace."""
+    import main_algorithm as main  # main_algorithm imports this module
+    exact = trace.algorithm == "exact"
+    min_radius = 0 if exact else main.epsilon
+    if trace.min_radius != min_radius:
+        raise SweepTraceError("traced with min radius {!r}, but it's {!r} now"
+                              .format(trace.min_radius, min_radius))
+    fudge = getattr(main, trace.fudge)
+    replayed = SweepTrace()
+    if trace.below:
+        main.QueryDiagram(trace.A, fudge=fudge, queue_cls=trace.queue_cls,
+                          exact=exact).distance_below(trace.B, trace.bound, trace=replayed)
+    elif trace.algorithm == "original":
+        main.shifted_bottleneck_distance(trace.A, trace.B, fudge=fudge, trace=replayed)
+    else:
+        main.other_shifted_bottleneck_distance(trace.A, trace.B, fudge=fudge,
+                                               queue_cls=trace.queue_cls,
+                                               upper_bound=trace.bound, exact=exact,
+                                               trace=replayed)
+    return Trace(replayed.buffer)
+
+
+def first_difference(trace, other):
+    """The index of the first record where the two traces differ, ignoring
+    times, or None if they don't."""
+    def untimed(record):
+        if isinstance(record, MatchingRecord):
+            return type(record), record.radius, record.shift, record.perfect
+        return (type(record),) + record[:-1]
+    for i, (record, other_record) in enumerate(zip(trace.records, other.records)):
+        if untimed(record) != untimed(other_record):
+            return i
+    if len(trace.records) != len(other.records):
+        return min(len(trace.records), len(other.records))
+    return None
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize or replay a sweep trace.")
+    parser.add_argument("command", choices=["summary", "replay"])
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+    trace = Trace.load(args.path)
+    if args.command == "summary":
+        summary = summarize(trace)
+        slowest = summary.pop("slowest_matchings")
+        for key, value in summary.items():
+            print("{:<18} {}".format(key, value))
+        print("slowest matchings:")
+        for record in slowest:
+            print("  at {:.6f}s: {:.6f}s, radius {!r}, shift {!r}{}".format(
+                record.time, record.duration, record.radius, record.shift,
+                ", perfect" if record.perfect else ""))
+        return 0
+    replayed = replay(trace)
+    difference = first_difference(trace, replayed)
+    if difference is None:
+        print("replayed {} records, distance {!r}: identical".format(
+            len(replayed.records), replayed.distance))
+        return 0
+    print("traces differ at record {}:".format(difference))
+    for name, records in (("recorded", trace.records), ("replayed", replayed.records)):
+        print("  {}: {}".format(name, records[difference] if difference < len(records)
+                                else "(end of trace)"))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli(sys.argv[1:]))
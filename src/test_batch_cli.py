@@ -0,0 +1,141 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import batch_cli
+import diagram_store as ds
+import main_algorithm as main
+import plane_util as pu
+import result_cache
+import sweep_trace
+
+
+def _die_on_line_3(line_number, text, compute_line=batch_cli._compute_line):
+    # Stands in for the worker being killed, e.g. for running out of memory.
+    if line_number == 3:
+        os._exit(1)
+    return compute_line(line_number, text)
+
+
+def _diagrams():
+    return [[pu.Point(x, y) for x, y in pts] for pts in (
+        [(0, 2)] * 3 + [(10, 20)],
+        [(100, 104)],
+        [(1, 4), (4, 7), (3, 8)],
+        [(2, 5), (3, 6), (3, 7)],
+    )]
+
+
+class BatchCliTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.diagrams = _diagrams()
+        self.pairs = [(i, j) for i in range(4) for j in range(4)]
+        self.expected = [main.other_shifted_bottleneck_distance(self.diagrams[i],
+                                                                self.diagrams[j])
+                         for i, j in self.pairs]
+
+    def jsonl(self):
+        lines = [json.dumps({"id": n, "A": self.diagrams[i], "B": self.diagrams[j]})
+                 for n, (i, j) in enumerate(self.pairs)]
+        return io.StringIO("\n".join(lines[:5] + ["", "not json"] + lines[5:]) + "\n")
+
+    def run_cli(self, lines, **kwargs):
+        out = io.StringIO()
+        failures = batch_cli.run(lines, out, **kwargs)
+        return failures, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def assert_distances(self, results, ordered=True):
+        if not ordered:
+            results = sorted(results, key=lambda result: result["line"])
+        self.assertEqual([result["id"] for result in results], list(range(len(self.pairs))))
+        for result, expected in zip(results, self.expected):
+            self.assertAlmostEqual(result["distance"], expected)
+
+    def test_single_process(self):
+        failures, results = self.run_cli(self.jsonl(), workers=1, chunksize=3)
+        self.assertEqual(failures, 1)
+        self.assertEqual([result["line"] for result in results],
+                         list(range(1, 6)) + list(range(7, 19)))
+        self.assertIn("error", results[5])
+        self.assert_distances(results[:5] + results[6:])
+
+    def test_process_pool(self):
+        for ordered in [True, False]:
+            failures, results = self.run_cli(self.jsonl(), workers=2, ordered=ordered,
+                                             max_pending=4, chunksize=2)
+            self.assertEqual(failures, 1)
+            self.assert_distances([result for result in results if "error" not in result],
+                                  ordered=ordered)
+
+    @mock.patch.object(batch_cli, "_POLL_SECONDS", 0.05)
+    @mock.patch.object(batch_cli, "_compute_line", _die_on_line_3)
+    def test_dead_worker(self):
+        # The patches reach the workers because they're forked.
+        for ordered in [True, False]:
+            failures, results = self.run_cli(self.jsonl(), workers=2, ordered=ordered,
+                                             chunksize=2)
+            self.assertEqual(failures, 3)  # lines 3 and 4, and "not json"
+            self.assertEqual(sorted(result["line"] for result in results),
+                             list(range(1, 6)) + list(range(7, 19)))
+            died = sorted(result["line"] for result in results
+                          if result.get("error") == "worker process died")
+            self.assertEqual(died, [3, 4])
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "library.sbd")
+            ds.write_store(path, self.diagrams)
+            lines = io.StringIO("".join("{} {}\n".format(i, j) for i, j in self.pairs))
+            failures, results = self.run_cli(lines, store=path, workers=2)
+            self.assertEqual(failures, 0)
+            self.assertEqual([(result["A"], result["B"]) for result in results], self.pairs)
+            for result, expected in zip(results, self.expected):
+                self.assertAlmostEqual(result["distance"], expected)
+            for algorithm in main.ALGORITHMS:
+                lines.seek(0)
+                failures, results = self.run_cli(lines, store=path, workers=1,
+                                                 algorithm=algorithm, diagram_cache_points=100)
+                self.assertEqual(failures, 0)
+                for result, expected in zip(results, self.expected):
+                    self.assertAlmostEqual(result["distance"], expected)
+                # each diagram in the store was read once
+                self.assertEqual(batch_cli._worker_diagram_cache.misses, len(self.diagrams))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cache.sqlite")
+            for _ in range(2):
+                failures, results = self.run_cli(self.jsonl(), workers=2, cache=path)
+                self.assertEqual(failures, 1)
+                self.assert_distances([result for result in results if "error" not in result])
+            with result_cache.ResultCache(path) as cache:
+                self.assertEqual(len(cache), 10)  # d(A, B) == d(B, A)
+
+    def test_traces(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _, results = self.run_cli(self.jsonl(), workers=2, trace_dir=tmpdir)
+            traced = [result for result in results if "trace" in result]
+            self.assertEqual(len(traced), len(self.pairs))
+            trace = sweep_trace.Trace.load(traced[0]["trace"])
+            self.assertEqual(trace.distance, traced[0]["distance"])
+            _, results = self.run_cli(self.jsonl(), workers=1, trace_dir=tmpdir,
+                                      trace_slower_than=60)
+            self.assertFalse(any("trace" in result for result in results))
+
+    def test_algorithms(self):
+        for algorithm in main.ALGORITHMS:
+            _, results = self.run_cli(self.jsonl(), algorithm=algorithm, workers=1)
+            self.assert_distances([result for result in results if "error" not in result])
+            _, results = self.run_cli(self.jsonl(), algorithm=algorithm, workers=2,
+                                      diagram_cache_points=100)
+            self.assert_distances([result for result in results if "error" not in result])
+        with self.assertRaises(ValueError):
+            self.run_cli(self.jsonl(), algorithm="nonsense")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+import benchmark
+import plane_util as pu
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_generators_are_reproducible(self):
+        for name in benchmark.PAIRS:
+            A, B = benchmark.diagram_pair(name, 20, random.Random(3))
+            self.assertEqual((A, B), benchmark.diagram_pair(name, 20, random.Random(3)))
+            self.assertEqual((len(A), len(B)), (20, 20))
+            self.assertTrue(all(y >= x for x, y in A + B))
+        diagram = benchmark.high_multiplicity_diagram(100, random.Random(0), distinct=4)
+        self.assertLessEqual(len(pu.SaneCounter(diagram)), 4)
+
+    def test_scaling_exponent(self):
+        sizes = [10, 100, 1000]
+        self.assertAlmostEqual(benchmark.scaling_exponent(sizes, [n ** 2 for n in sizes]), 2)
+        self.assertAlmostEqual(benchmark.scaling_exponent(sizes, [5, 5, 5]), 0)
+        self.assertIsNone(benchmark.scaling_exponent([10, 10], [1, 2]))
+        self.assertIsNone(benchmark.scaling_exponent([], []))
+
+    def test_run(self):
+        results = benchmark.run([4, 8], max_distance_size=4)
+        self.assertEqual(len(results["efrat"]),
+                         2 * len(benchmark.GENERATORS) * len(benchmark.EFRAT_CLASSES))
+        self.assertEqual({row["n"] for row in results["distance"]}, {4})
+        self.assertEqual({(row["n"], row["reason"]) for row in results["skipped"]},
+                         {(8, "max_distance_size")})
+        self.assertTrue(all(row["peak_memory"] > 0 for row in results["efrat"]))
+        self.assertIn("uniform/GridEfratStructure", results["scaling"]["drain"])
+        comparison = benchmark.compare_results(results, results)
+        self.assertEqual(len(comparison),
+                         2 * len(results["efrat"]) + len(results["distance"]))
+        self.assertTrue(all(old == new for *_, old, new in comparison))
+
+    def test_time_limit(self):
+        expected = benchmark.compare_algorithms([4, 8], pairs=["uniform"], memory=True)
+        rows = benchmark.compare_algorithms([4, 8], pairs=["uniform"], memory=True,
+                                            time_limit=60)
+        self.assertEqual([(row["n"], row["distance"]) for row in rows],
+                         [(row["n"], row["distance"]) for row in expected])
+        self.assertTrue(all(row["peak_memory"] > 0 for row in rows))
+        # every run is killed, and the larger sizes aren't started
+        skipped = []
+        self.assertEqual(benchmark.compare_algorithms([8, 4], pairs=["uniform"],
+                                                      time_limit=0, skipped=skipped), [])
+        self.assertEqual(sorted((row["n"], row["reason"]) for row in skipped),
+                         [(4, "time_limit")] * 2 + [(8, "time_limit")] * 2)
+
+if __name__ == "__main__":
+    unittest.main()
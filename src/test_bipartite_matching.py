@@ -54,11 +54,11 @@ class GeometricBipartiteMatchingTestCase(unittest.TestCase):
         self.assert_edges(gm, expected_edges)
         self.assertTrue(gm.diagonal_perfect())
         self.assertEqual(gm.value(), 1.5)
-        gm.remove_all((pu.Point(4.5, 4.5), B[2]))
+        gm.remove_all((gm.A_diag, B[2]))
         self.assert_sanity(gm)
         self.assert_edges(gm, expected_edges[:-2])  # both copies should be gone
         for edge in set(expected_edges):
-            gm.remove_all(edge)
+            gm.remove_all(fix_diagonals(gm, edge))
             self.assert_sanity(gm)
         self.assert_edges(gm, [])
         # Now let's go for the gold
@@ -68,6 +68,42 @@ class GeometricBipartiteMatchingTestCase(unittest.TestCase):
         self.assertTrue(gm.diagonal_perfect())
         self.assertEqual(gm.value(), 0)
 
+    def test_maximizing_matching_with_multiplicity(self):
+        A = [pu.Point(0, 2)] * 40 + [pu.Point(2, 5)] * 25
+        B = [pu.Point(1, 3)] * 30 + [pu.Point(3, 6)] * 25
+        gm = bpm.GeometricBipartiteMatching(A, B)
+        gm.maximize_matching(shift=1, radius=0.5)
+        self.assert_sanity(gm)
+        self.assertFalse(gm.diagonal_perfect())
+        self.assertEqual(gm.matching.count_edge(A[0], B[0]), 30)
+        self.assertEqual(gm.matching.count_edge(A[-1], B[-1]), 25)
+        gm.maximize_matching(shift=1, radius=1.01)
+        self.assert_sanity(gm)
+        self.assertTrue(gm.diagonal_perfect())
+        self.assertEqual(gm.value(), 1)
+
+    def test_shrink_radius(self):
+        A = [pu.Point(1, 4), pu.Point(1, 4), pu.Point(4, 7), pu.Point(3, 8)]
+        B = [pu.Point(2, 5), pu.Point(3, 6), pu.Point(3, 7)]
+        gm = bpm.GeometricBipartiteMatching(A, B)
+        gm.maximize_matching(shift=0, radius=10)
+        self.assertTrue(gm.diagonal_perfect())
+        for radius, perfect in [(3, True), (1.6, True), (1.5, False), (1.2, False)]:
+            gm.shrink_radius(radius, shift=0)
+            self.assert_sanity(gm)
+            self.assertEqual(gm.diagonal_perfect(), perfect)
+            self.assertLess(gm.matching_value_fixed_shift(gm.matching, shift=0), radius)
+            fresh = bpm.GeometricBipartiteMatching(A, B)
+            fresh.maximize_matching(shift=0, radius=radius)
+            self.assertEqual(len(gm.matching), len(fresh.matching))
+        gm.shrink_radius(1.5, shift=0, closed=True)
+        self.assertTrue(gm.diagonal_perfect())
+        gm.shrink_radius(1.5, shift=1, closed=True)
+        self.assert_sanity(gm)
+        fresh = bpm.GeometricBipartiteMatching(A, B)
+        fresh.maximize_matching(shift=1, radius=1.5, closed=True)
+        self.assertEqual(len(gm.matching), len(fresh.matching))
+
     def _hanging_fp_instance(self):
         A = [(-432.94192024932653, 530.4790466084148),
              (-74.80546818492695, 626.5615783097762),
@@ -112,17 +148,10 @@ class GeometricBipartiteMatchingTestCase(unittest.TestCase):
         self.assertFalse(gm.diagonal_perfect())
 
     def assert_edges(self, matching, edges):
-        def fix_diagonals(edge):
-            if edge[0][0] == edge[0][1]:
-                return (matching.A_diag, edge[1])
-            elif edge[1][0] == edge[1][1]:
-                return (edge[0], matching.B_diag)
-            else:
-                return edge
         backup, self.longMessage = self.longMessage, True
         self.assertEqual(Counter((edge[0], edge[1]) for edge in matching.edges(repeats=True)
                                  if edge[0] != matching.A_diag or edge[1] != matching.B_diag),
-                         Counter(fix_diagonals(e) for e in edges),
+                         Counter(fix_diagonals(matching, e) for e in edges),
                          msg="\nexpected: {}\nactual: {}".format(
                              Counter(edges),
                              Counter(matching.edges(repeats=True))))
@@ -131,7 +160,19 @@ class GeometricBipartiteMatchingTestCase(unittest.TestCase):
     def assert_sanity(self, matching):
         assert_sanity(self, matching)
 
+def fix_diagonals(matching, edge):
+    # Points on the diagonal stand for the diagonal vertex on their side.
+    if edge[0][0] == edge[0][1]:
+        return (matching.A_diag, edge[1])
+    elif edge[1][0] == edge[1][1]:
+        return (edge[0], matching.B_diag)
+    else:
+        return edge
+
 def assert_sanity(self, matching):
+    for a, b in matching.matching.ctr:
+        self.assertIn(a, matching.A)
+        self.assertIn(b, matching.B)
     for a in matching.A:
         self.assertEqual(matching.A[a] - matching.matching.degree(a, in_A=True),
                          matching.A_exposed[a])
@@ -0,0 +1,59 @@
+import random
+import unittest
+
+import bounds
+import main_algorithm as main
+import plane_util as pu
+
+
+def _random_diagram(rng, size):
+    points = []
+    for _ in range(size):
+        x = rng.randint(0, 20)
+        points.append(pu.Point(x, x + rng.randint(1, 10)))
+    return points
+
+
+class BoundsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.library = [_random_diagram(rng, rng.randint(0, 5)) for _ in range(25)]
+
+    def test_bounds_contain_distance(self):
+        for A in self.library[:8]:
+            for B in self.library:
+                lower, upper = bounds.bounds(A, B)
+                dist = main.other_shifted_bottleneck_distance(A, B)
+                self.assertLessEqual(lower, dist + 1e-9)
+                self.assertLessEqual(dist, upper)
+
+    def test_simple_bounds(self):
+        A = [pu.Point(0, 2)] * 3 + [pu.Point(10, 20)]
+        B = [pu.Point(100, 104)]
+        self.assertEqual(bounds.bounds(A, B), (3, 3))
+        self.assertEqual(bounds.bounds(A, A), (0, 0))
+        self.assertEqual(bounds.bounds([], []), (0, 0))
+
+    def test_nearest_neighbors(self):
+        query = self.library[0]
+        distances = sorted((main.other_shifted_bottleneck_distance(query, B), index)
+                           for index, B in enumerate(self.library))
+        for k in [1, 3, 10]:
+            found = bounds.nearest_neighbors(query, self.library, k=k)
+            self.assertEqual(len(found), k)
+            for (dist, _), (expected, _) in zip(found, distances):
+                self.assertAlmostEqual(dist, expected)
+        self.assertEqual(bounds.nearest_neighbors(query, [], k=2), [])
+
+    def test_within_radius(self):
+        query = self.library[1]
+        # Distances here are multiples of 0.5, so stay clear of them.
+        for radius in [0.75, 2.25, 3.75]:
+            expected = [index for index, B in enumerate(self.library)
+                        if main.other_shifted_bottleneck_distance(query, B) < radius]
+            self.assertEqual(bounds.within_radius(query, self.library, radius), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
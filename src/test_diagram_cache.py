@@ -0,0 +1,101 @@
+import fractions
+import unittest
+
+import diagram_cache as dc
+import event_queue
+import main_algorithm as main
+import plane_util as pu
+
+
+def _diagram(n, offset=0):
+    return [pu.Point(x + offset, x + offset + 1 + x % 3) for x in range(n)]
+
+
+class DiagramCacheTestCase(unittest.TestCase):
+
+    def test_prepared_diagram(self):
+        diagram = _diagram(5) * 2
+        prepared = dc.PreparedDiagram(diagram)
+        self.assertEqual(prepared.counter, pu.SaneCounter(diagram))
+        self.assertEqual(len(prepared), 5)
+        self.assertEqual(prepared.height, 1.5)
+        self.assertEqual(prepared.diag_edges(in_A=False),
+                         event_queue.sorted_diag_edges(prepared.counter, in_A=False))
+        self.assertIs(prepared.diag_edges(in_A=True), prepared.diag_edges(in_A=True))
+        exact = prepared.exact()
+        self.assertTrue(all(isinstance(coord, fractions.Fraction)
+                            for pt in exact.counter for coord in pt))
+        self.assertIs(prepared.exact(), exact)
+        self.assertEqual(dc.PreparedDiagram([]).height, 0)
+        # it can stand in for the diagram
+        self.assertEqual(prepared.size, 10)
+        self.assertEqual(pu.SaneCounter(prepared), prepared.counter)
+        self.assertEqual(main.shifted_bottleneck_distance(prepared, _diagram(4)),
+                         main.shifted_bottleneck_distance(diagram, _diagram(4)))
+
+    def test_hits(self):
+        cache = dc.DiagramCache()
+        first = cache.prepare(_diagram(5))
+        self.assertIs(cache.prepare(_diagram(5)), first)
+        self.assertIs(cache.prepare(pu.SaneCounter(_diagram(5))),
+                      cache.prepare(dict(pu.SaneCounter(_diagram(5)))))
+        self.assertIs(cache.prepare(first), first)
+        self.assertIs(cache.prepare(_diagram(5)[::-1]), first)
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+    def test_keyed(self):
+        cache = dc.DiagramCache()
+        loads = []
+        def load():
+            loads.append(1)
+            return _diagram(5)
+        first = cache.prepare_keyed(7, load)
+        self.assertIs(cache.prepare_keyed(7, load), first)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(first.counter, pu.SaneCounter(_diagram(5)))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_iterators(self):
+        cache = dc.DiagramCache()
+        diagram = _diagram(5) * 2
+        for points in [iter(diagram), (pt for pt in diagram)]:
+            self.assertEqual(cache.prepare(points).counter, pu.SaneCounter(diagram))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        A, B = _diagram(4), _diagram(5, offset=2)
+        expected = main.other_shifted_bottleneck_distance(A, B)
+        self.assertEqual(main.other_shifted_bottleneck_distance(iter(A), (pt for pt in B)),
+                         expected)
+        query = main.QueryDiagram(iter(A), cache=cache)
+        self.assertEqual(query.distance_to(pt for pt in B), expected)
+        self.assertEqual(query.distance_to(iter(B)), expected)
+
+    def test_eviction(self):
+        for policy, survivor in [("lru", 0), ("fifo", 1)]:
+            cache = dc.DiagramCache(max_points=10, policy=policy)
+            diagrams = [_diagram(4, offset=10 * i) for i in range(3)]
+            prepared = [cache.prepare(diagram) for diagram in diagrams[:2]]
+            cache.prepare(diagrams[0])
+            cache.prepare(diagrams[2])
+            self.assertEqual(len(cache), 2)
+            self.assertIs(cache.prepare(diagrams[survivor]), prepared[survivor])
+            # too big to keep at all
+            cache.prepare(_diagram(11))
+            self.assertEqual(len(cache), 2)
+        with self.assertRaises(ValueError):
+            dc.DiagramCache(policy="random")
+
+    def test_query_diagram_uses_cache(self):
+        cache = dc.DiagramCache()
+        A, B = _diagram(4), _diagram(5, offset=2)
+        query = main.QueryDiagram(A, cache=cache)
+        self.assertEqual(query.distance_to(B), main.other_shifted_bottleneck_distance(A, B))
+        query.distance_to(B)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        # nothing is cached without a cache
+        self.assertIsNone(main.QueryDiagram(A).cache)
+        self.assertEqual(main.QueryDiagram(A, cache=cache, exact=True).distance_to(B),
+                         main.other_shifted_bottleneck_distance(A, B, exact=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import glob
+import io
+import os
+import pickle
+import tempfile
+import unittest
+
+import diagram_store as ds
+import main_algorithm as main
+import plane_util as pu
+
+
+class DiagramStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "library.sbd")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        diagrams = [[pu.Point(0, 2)] * 3 + [pu.Point(10, 20)],
+                    [],
+                    [pu.Point(100, 104)],
+                    {pu.Point(1.5, 4.25): 7}]
+        ds.write_store(self.path, diagrams)
+        with ds.DiagramStore(self.path) as store:
+            self.assertEqual(len(store), 4)
+            self.assertEqual(list(store), [pu.SaneCounter(d) for d in diagrams])
+            self.assertEqual(store[-1], pu.SaneCounter(diagrams[-1]))
+            coords, mults = store.raw(0)
+            self.assertEqual(list(coords), [0, 2, 10, 20])
+            self.assertEqual(list(mults), [3, 1])
+            with self.assertRaises(IndexError):
+                store[4]
+            copy = pickle.loads(pickle.dumps(store))
+            self.assertEqual(copy[2], store[2])
+            copy.close()
+
+    def test_without_multiplicities(self):
+        ds.write_store(self.path, [[pu.Point(0, 2), pu.Point(1, 3)]])
+        with ds.DiagramStore(self.path) as store:
+            self.assertIsNone(store.raw(0)[1])
+            self.assertEqual(store[0], pu.SaneCounter([pu.Point(0, 2), pu.Point(1, 3)]))
+
+    def test_sample_instances(self):
+        filenames = sorted(glob.glob("sample_instances/*.json"))
+        ds.json_to_store(filenames, self.path)
+        with ds.DiagramStore(self.path) as store:
+            self.assertEqual(len(store), 2 * len(filenames))
+            for index, filename in enumerate(filenames):
+                with open(filename, "r") as f:
+                    A, B = main.weighted_instance_from_file(f)
+                self.assertEqual((store[2 * index], store[2 * index + 1]), (A, B))
+            out = io.StringIO()
+            ds.store_to_json(store, 0, 1, out)
+            out.seek(0)
+            self.assertEqual(main.weighted_instance_from_file(out), (store[0], store[1]))
+
+    def test_bad_files(self):
+        for contents in [b"", b"not a store"]:
+            with open(self.path, "wb") as f:
+                f.write(contents)
+            with self.assertRaises(ds.DiagramStoreError):
+                ds.DiagramStore(self.path)
+        ds.write_store(self.path, [[pu.Point(0, 2)]])
+        with open(self.path, "ab") as f:
+            f.write(b"\0" * 8)
+        with self.assertRaises(ds.DiagramStoreError):
+            ds.DiagramStore(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
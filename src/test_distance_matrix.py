@@ -0,0 +1,87 @@
+import math
+import os
+import tempfile
+import unittest
+
+import distance_matrix as dm
+import main_algorithm as main
+import plane_util as pu
+
+
+def _diagrams():
+    return [[pu.Point(x, y) for x, y in pts] for pts in (
+        [(0, 2)] * 3 + [(10, 20)],
+        [(100, 104)],
+        [(1, 4), (4, 7), (3, 8)],
+        [(2, 5), (3, 6), (3, 7)],
+    )]
+
+
+class DistanceMatrixTestCase(unittest.TestCase):
+
+    def test_condensed_index(self):
+        n = 4
+        indices = [dm.condensed_index(i, j, n)
+                   for i in range(n) for j in range(i + 1, n)]
+        self.assertEqual(indices, list(range(dm.condensed_size(n))))
+        self.assertEqual(dm.condensed_index(3, 1, n), dm.condensed_index(1, 3, n))
+        with self.assertRaises(ValueError):
+            dm.condensed_index(2, 2, n)
+
+    def assert_matches_direct(self, matrix, diagrams):
+        n = len(diagrams)
+        self.assertEqual(len(matrix), dm.condensed_size(n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                self.assertAlmostEqual(
+                    matrix[dm.condensed_index(i, j, n)],
+                    main.other_shifted_bottleneck_distance(diagrams[i], diagrams[j]))
+
+    def test_single_worker(self):
+        diagrams = _diagrams()
+        self.assert_matches_direct(dm.pairwise_distance_matrix(diagrams, workers=1),
+                                   diagrams)
+
+    def test_process_pool(self):
+        diagrams = _diagrams()
+        self.assert_matches_direct(
+            dm.pairwise_distance_matrix(diagrams, workers=2, chunksize=1),
+            diagrams)
+
+    def test_diagram_cache(self):
+        diagrams = _diagrams()
+        for workers in [1, 2]:
+            self.assert_matches_direct(
+                dm.pairwise_distance_matrix(diagrams, workers=workers,
+                                            diagram_cache_points=100),
+                diagrams)
+        # in this process, each diagram was prepared once
+        self.assertEqual((dm._worker_diagram_cache.hits, dm._worker_diagram_cache.misses),
+                         (2 * dm.condensed_size(len(diagrams)) - len(diagrams),
+                          len(diagrams)))
+
+    def test_resume_from_checkpoint(self):
+        diagrams = _diagrams()
+        n = len(diagrams)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "matrix.bin")
+            partial = dm.pairwise_distance_matrix(diagrams,
+                                                  workers=1, checkpoint=path)
+            # Pretend only one entry was finished, with a recognizable value.
+            for index in range(len(partial)):
+                partial[index] = math.nan
+            partial[dm.condensed_index(0, 1, n)] = 1234.5
+            dm.save_checkpoint(path, partial)
+
+            resumed = dm.pairwise_distance_matrix(diagrams, workers=1, checkpoint=path)
+            self.assertEqual(resumed[dm.condensed_index(0, 1, n)], 1234.5)
+            self.assertAlmostEqual(
+                resumed[dm.condensed_index(2, 3, n)],
+                main.other_shifted_bottleneck_distance(diagrams[2], diagrams[3]))
+            self.assertEqual(list(dm.load_checkpoint(path, n)), list(resumed))
+            with self.assertRaises(ValueError):
+                dm.load_checkpoint(path, n + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,6 +14,41 @@ class EventQueueTestCase(unittest.TestCase):
                 break
             self.assertIsInstance(queue.next_event(radius=3), event_queue.Event)
         self.assertFalse(bool(queue))
-        
+
+    def test_queues_agree(self):
+        A = pu.SaneCounter([pu.Point(x,y) for x,y in [(1, 2), (2, 3), (2, 3), (3, 5), (0, 7)]])
+        B = pu.SaneCounter([pu.Point(x,y) for x,y in [(1, 2), (3, 18), (4, 6)]])
+        queues = [event_queue.EventQueue(A, B), event_queue.ArrayEventQueue(A, B),
+                  event_queue.LazyEventQueue(A, B)]
+        for radius in [3, 2, 2, 1.5, 1, 1, 0.5]:
+            events = [queue.next_event(radius) for queue in queues]
+            self.assertEqual([type(event) for event in events[1:]],
+                             [type(events[0])] * (len(events) - 1))
+            self.assertEqual([event.edge for event in events[1:]],
+                             [events[0].edge] * (len(events) - 1))
+            self.assertEqual([queue.next_exit_shift(radius) for queue in queues[1:]],
+                             [queues[0].next_exit_shift(radius)] * (len(queues) - 1))
+            if isinstance(events[0], event_queue.EntryEvent):
+                for queue, event in zip(queues, events):
+                    queue.push(event)
+                    self.assertEqual(queue.next_event(radius).edge, event.edge)
+
+    def test_merged_edge_stream_order(self):
+        A = [pu.Point(x,y) for x,y in [(1, 2), (2, 3), (3, 5), (0, 7), (4, 4.5)]]
+        B = [pu.Point(x,y) for x,y in [(1, 2), (3, 18), (4, 6), (-2, 1)]]
+        all_edges = sorted(event_queue.Edge(a, b) for a in A for b in B)
+        for exits, key in [(False, event_queue.birth), (True, event_queue.death)]:
+            stream = event_queue.MergedEdgeStream(A, B, exits=exits)
+            self.assertEqual(len(stream), len(all_edges))
+            edges = []
+            while stream:
+                edges.append(stream.pop())
+                if len(edges) == 3:
+                    stream.push(edges[-1])
+                    self.assertEqual(stream.pop(), edges[-1])
+            self.assertEqual(sorted(edges), all_edges)
+            keys = [key(edge, 0) for edge in edges]
+            self.assertEqual(keys, sorted(keys))
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,18 @@
 from collections import Counter
+import fractions
 import glob
+import io
+import json
 import logging
+import math
 import sys
 import unittest
+import event_queue
+from bipartite_matching import GeometricBipartiteMatching
 import main_algorithm as main
 import plane_util as pu
+import sweep_stats
+import sweep_trace
 import traceback
 
 class ShiftedBottleneckDistanceTestCase(unittest.TestCase):
@@ -28,6 +36,11 @@ class ShiftedBottleneckDistanceTestCase(unittest.TestCase):
         B = [pu.Point(100, 104)]
         self.assert_dist(A, B, 3)
 
+    def test_instance_0_with_high_multiplicity(self):
+        A = [pu.Point(x, y) for x, y in [(0, 2)] * 300 + [(10, 20)] * 40]
+        B = [pu.Point(x, y) for x, y in [(100, 104)] * 40 + [(50, 52)] * 200]
+        self.assert_dist(A, B, 3)
+
     def test_instance_1(self):
         A = [pu.Point(x, y) for x, y in [(0, 10)] * 3 + [(10, 30)]]
         B = [pu.Point(x, y) for x, y in [(100, 110)] * 3 + [(110, 130)]]
@@ -50,6 +63,20 @@ class ShiftedBottleneckDistanceTestCase(unittest.TestCase):
         B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
         self.assert_dist(A, B, 1.5)
 
+    def test_point_on_the_diagonal(self):
+        # (1, 1) is a point of B, not the diagonal end of a diagonal edge.
+        A = [pu.Point(x, y) for x, y in [(1, 4), (0, 2), (2, 4)]]
+        B = [pu.Point(x, y) for x, y in [(4, 6), (4, 7), (1, 1)]]
+        self.assert_dist(A, B, 1)
+
+    def test_edge_at_the_radius(self):
+        # Used to loop forever: one side of the matching rounded an edge to
+        # just inside the radius, and the other side to just outside it.
+        A = [pu.Point(x, y) for x, y in [(0, 3), (1.73, 3.29), (5.81, 6.31), (4, 7), (0, 3)]]
+        B = [pu.Point(x, y) for x, y in [(4, 7.79), (5.31, 9.309999999999999), (6.63, 7.13),
+                                         (3, 5.5600000000000005), (2, 5.74)]]
+        self.assert_dist(A, B, 1.595)
+
     def test_when_A_and_B_same(self):
         A = [pu.Point(x, y) for x, y in [(1, 2), (3, 10), (-10.001, 4.8)]]
         B = list(A)
@@ -92,6 +119,151 @@ class ShiftedBottleneckDistanceTestCase(unittest.TestCase):
         self.assertAlmostEqual(main.shifted_bottleneck_distance(B, A, analysis=verbose), distance)
         self.assertAlmostEqual(main.other_shifted_bottleneck_distance(A, B, analysis=verbose), distance)
         self.assertAlmostEqual(main.other_shifted_bottleneck_distance(B, A, analysis=verbose), distance)
+        for queue_cls in (event_queue.ArrayEventQueue, event_queue.LazyEventQueue):
+            self.assertAlmostEqual(main.other_shifted_bottleneck_distance(
+                A, B, queue_cls=queue_cls), distance)
+
+    def test_query_diagram(self):
+        library = [[]]
+        for A, B, filename in _sample_instances():
+            if "/s" in filename:
+                library += [A, B]
+        for B in library:
+            query = main.QueryDiagram(B)
+            self.assertEqual(query.distances_to(library),
+                             [main.other_shifted_bottleneck_distance(B, A)
+                              for A in library])
+        query = main.QueryDiagram(library[1])
+        distances = query.distances_to(library)
+        stats = sweep_stats.SweepStats()
+        pruned = query.distances_to(library, upper_bound=lambda found: min(found, default=None),
+                                    stats=stats)
+        self.assertGreater(stats.matchings, 0)
+        for i, distance in enumerate(distances):
+            closest = min(distances[:i], default=math.inf)
+            if distance < closest:
+                self.assertEqual(pruned[i], distance)
+            elif distance > closest * (1 + main.epsilon) + main.epsilon:
+                self.assertEqual(pruned[i], math.inf)
+        self.assertEqual(query.distances_to(library, upper_bound=0), [math.inf] * len(library))
+
+    def test_upper_bound_and_threshold(self):
+        A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8)]]
+        B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+        for bound in [1.6, 2, 100]:
+            self.assertAlmostEqual(
+                main.other_shifted_bottleneck_distance(A, B, upper_bound=bound), 1.5)
+            self.assertTrue(main.distance_below(A, B, bound))
+        for bound in [0.5, 1.4]:
+            self.assertEqual(
+                main.other_shifted_bottleneck_distance(A, B, upper_bound=bound), math.inf)
+            self.assertFalse(main.distance_below(A, B, bound))
+        self.assertEqual(main.other_shifted_bottleneck_distance([], [], upper_bound=1), 0)
+        self.assertEqual(main.other_shifted_bottleneck_distance([], [], upper_bound=0),
+                         math.inf)
+        self.assertFalse(main.distance_below([], [], 0))
+
+    def test_bottleneck_distance(self):
+        A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8)]]
+        B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+        for shift, distance in [(0, 1.5), (1, 2), (-1, 1.5), (10, 2.5)]:
+            self.assertEqual(main.bottleneck_distance(A, B, shift=shift), distance)
+        self.assertEqual(main.bottleneck_distance([], []), 0)
+        self.assertEqual(main.bottleneck_distance(A, []), 2.5)
+        for A, B, filename in _sample_instances():
+            if "/s" in filename:
+                shift = 0.25
+                moved = [pu.Point(x + shift, y + shift) for x, y in A]
+                self.assertAlmostEqual(main.bottleneck_distance(A, B, shift=shift),
+                                       main.bottleneck_distance(moved, B))
+                self.assertGreaterEqual(main.bottleneck_distance(A, B),
+                                        main.other_shifted_bottleneck_distance(A, B))
+
+    def test_full_result(self):
+        A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8)]]
+        B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+        result = main.other_shifted_bottleneck_distance(A, B, full_result=True)
+        self.assertEqual(result.distance, main.other_shifted_bottleneck_distance(A, B))
+        self.assertEqual(sum(mult for (a, b), mult in result.matching.items()
+                             if a is not pu.A_DIAG), 4)
+        self.assertEqual(sum(mult for (a, b), mult in result.matching.items()
+                             if b is not pu.B_DIAG), 3)
+        low, high = result.shifts
+        self.assertLessEqual(low, result.shift)
+        self.assertLessEqual(result.shift, high)
+        for shift in [low, result.shift, high]:
+            self.assertLessEqual(
+                max(GeometricBipartiteMatching.edge_length(a, b, shift)
+                    for a, b in result.matching),
+                1.5)
+        exact = main.other_shifted_bottleneck_distance(A, B, exact=True, full_result=True)
+        self.assertEqual(exact.distance, fractions.Fraction(3, 2))
+        # the optimal shifts are [-3/2, 1/2], but a given optimal matching
+        # may only work on part of that
+        low, high = exact.shifts
+        self.assertTrue(-1.5 <= low <= high <= 0.5)
+        for shift in [low, high]:
+            self.assertEqual(max(GeometricBipartiteMatching.edge_length(a, b, shift)
+                                 for a, b in exact.matching),
+                             fractions.Fraction(3, 2))
+        # nothing to match but the diagonal, at any shift
+        alone = main.QueryDiagram(A).distance_to([], full_result=True)
+        self.assertEqual(alone.distance, main.other_shifted_bottleneck_distance(A, []))
+        self.assertEqual(alone.shifts, (-math.inf, math.inf))
+        self.assertEqual(alone.shift, 0)
+        self.assertEqual(alone.matching[(pu.Point(1, 4), pu.B_DIAG)], 2)
+        bounded = main.other_shifted_bottleneck_distance(A, B, upper_bound=1, full_result=True)
+        self.assertEqual(bounded.distance, math.inf)
+        self.assertIsNone(bounded.matching)
+        empty = main.other_shifted_bottleneck_distance([], [], full_result=True)
+        self.assertEqual((empty.distance, empty.shifts), (0, (-math.inf, math.inf)))
+
+    def test_exact_mode(self):
+        A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8)]]
+        B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+        dist = main.other_shifted_bottleneck_distance(A, B, exact=True)
+        self.assertIsInstance(dist, fractions.Fraction)
+        self.assertEqual(dist, fractions.Fraction(3, 2))
+        for queue_cls in [event_queue.ArrayEventQueue, event_queue.LazyEventQueue]:
+            self.assertEqual(main.other_shifted_bottleneck_distance(
+                A, B, exact=True, queue_cls=queue_cls), dist)
+        self.assertTrue(main.QueryDiagram(A, exact=True).distance_below(B, 1.6))
+        self.assertFalse(main.QueryDiagram(A, exact=True).distance_below(B, 1.5))
+        # Thirds can't be written as floats.
+        third = fractions.Fraction(1, 3)
+        A = [pu.Point(0, 1), pu.Point(third, 2)]
+        B = [pu.Point(0, 1 + third), pu.Point(third, 2)]
+        self.assertEqual(main.other_shifted_bottleneck_distance(A, B, exact=True), third / 2)
+        for A, B, filename in _sample_instances():
+            if "/s" in filename:
+                dist = main.other_shifted_bottleneck_distance(A, B, exact=True)
+                self.assertAlmostEqual(dist, main.other_shifted_bottleneck_distance(A, B))
+                # a traced run is done with fractions instead of scaled integers
+                self.assertEqual(main.other_shifted_bottleneck_distance(
+                    A, B, exact=True, trace=sweep_trace.SweepTrace()), dist)
+        result = main.QueryDiagram(A, exact=True).distance_to(B, full_result=True)
+        self.assertTrue(all(isinstance(coord, fractions.Fraction)
+                            for edge in result.matching for pt in edge
+                            if pt is not pu.A_DIAG and pt is not pu.B_DIAG
+                            for coord in pt))
+
+    def test_diagram_from_arrays(self):
+        diagram = main.diagram_from_arrays([(0, 2), (10, 20), (0, 2)], [3, 0, 1])
+        self.assertEqual(diagram, Counter({pu.Point(0, 2): 4}))
+        self.assertEqual(main.diagram_from_arrays([[0, 2], [0, 2]]),
+                         Counter({pu.Point(0, 2): 2}))
+        with self.assertRaises(ValueError):
+            main.diagram_from_arrays([(0, 2)], [1, 2])
+        with self.assertRaises(ValueError):
+            main.diagram_from_arrays([(0, 2)], [-1])
+        instance = io.StringIO(json.dumps({"A": [[0, 2], [10, 20]], "A_mult": [300, 40],
+                                           "B": [[100, 104], [50, 52]], "B_mult": [40, 200]}))
+        A, B = main.weighted_instance_from_file(instance)
+        self.assertEqual(sum(A.values()), 340)
+        self.assert_dist(A, B, 3)
+        instance.seek(0)
+        self.assertEqual(main.instance_from_file(instance),
+                         (list(A.elements()), list(B.elements())))
 
     def test_birth_and_death(self):
         self.assertEqual(main.death(((0, 2), (100, 104)), 5), 105)
@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import fractions
+import math
 import unittest
 import plane_util as pu
 
@@ -14,6 +16,17 @@ class PlaneUtilFunctionalTestCase(unittest.TestCase):
         self.assertEqual(pu.closest_diag_point(pu.Point(3, 4)),
                          pu.Point(3.5, 3.5))
 
+    def test_scaling_to_integers(self):
+        self.assertEqual(pu.exact_denominator([pu.Point(0.25, 1), pu.Point(2, 3.5)]), 4)
+        self.assertEqual(pu.exact_denominator([pu.Point(fractions.Fraction(1, 3), 0.5)]), 6)
+        self.assertEqual(pu.scaled_point(pu.Point(0.25, 3.5), 8), pu.Point(2, 28))
+        self.assertEqual(pu.half(6), 3)
+        self.assertIs(type(pu.half(6)), int)
+        self.assertEqual(pu.half(3), 1.5)
+        self.assertEqual(pu.coordinate_array([1, 2]).typecode, 'q')
+        self.assertEqual(pu.coordinate_array([1.0, 2.0]).typecode, 'd')
+        self.assertEqual(pu.coordinate_array([2 ** 70]), [2 ** 70])
+
     def test_sort_convex_points_ccw(self):
         square = [pu.Point(0, 0), pu.Point(0, 1), pu.Point(1, 0), pu.Point(1, 1)]
         sorted_square = pu.sort_convex_vertices_ccw(*square)
@@ -167,9 +180,98 @@ class EfratTestCaseMixin:
         self.assertEqual(efrat.count(points[0]), 4)
         self.assertEqual(efrat.count(points[4]), 0)
 
+    def test_shifted_query(self):
+        points = self.whatever_points()
+        efrat = self.efrat_cls(*points, radius=1, closed=False)
+        self.assertEqual(efrat.neighbor(pu.Point(10, 9), shift=-10), pu.Point(0.8, -0.9))
+        self.assertIsNone(efrat.neighbor(pu.Point(10, 9)))
+        efrat.delete(pu.Point(0.8, -0.9))
+        self.assertIsNone(efrat.neighbor(pu.Point(10, 9), shift=-10))
+
+    def test_reset(self):
+        points = self.whatever_points()
+        efrat = self.efrat_cls(*(points * 2), radius=1, closed=True)
+        while efrat.neighbor(pu.Point(0, 1)) is not None:
+            efrat.delete(efrat.neighbor(pu.Point(0, 1)))
+        efrat.delete(points[0], mult=-1)
+        efrat.reset()
+        self.assertEqual([efrat.count(point) for point in points], [2] * len(points))
+        self.assertIsNotNone(efrat.neighbor(pu.Point(0, 1)))
+        self.assertIsNone(efrat.neighbor(pu.Point(0, -3)))
+        efrat.reset(radius=2.2)
+        self.assertEqual(efrat.neighbor(pu.Point(0, -3)), points[7])
+        efrat.delete(points[7], mult=2)
+        self.assertIsNone(efrat.neighbor(pu.Point(0, -3)))
+        efrat.reset(closed=False)
+        self.assertEqual(efrat.neighbor(pu.Point(0, -3)), points[7])
+
+
+class SimpleKDTreeTestCase(unittest.TestCase):
+    kd_tree_cls = pu.SimpleKDTree
+
+    def test_restore_deleted(self):
+        points = [pu.Point(x, y) for x in range(5) for y in range(5)]
+        tree = self.kd_tree_cls(*points)
+        for point in points[::2]:
+            tree.delete(point)
+        self.assertEqual(len(tree), len(points[1::2]))
+        self.assertEqual(sorted(tree), sorted(points[1::2]))
+        self.assertIsNone(tree.neighbor(pu.Point(0, 0), 0.5))
+        tree.restore_deleted()
+        self.assertEqual(len(tree), len(points))
+        self.assertEqual(sorted(tree), sorted(points))
+        self.assertEqual(tree.neighbor(pu.Point(0, 0), 0.5), pu.Point(0, 0))
+        for point in points:
+            tree.delete(point)
+        self.assertIsNone(tree.neighbor(pu.Point(2, 2), 10))
+        tree.restore_deleted()
+        self.assertIsNotNone(tree.neighbor(pu.Point(2, 2), 10))
+
+    def test_shifted_query(self):
+        points = [pu.Point(x, y) for x in range(5) for y in range(5)]
+        tree = self.kd_tree_cls(*points)
+        self.assertEqual(tree.neighbor(pu.Point(-2.75, 0.25), 0.5, shift=3),
+                         pu.Point(0, 3))
+        self.assertIsNone(tree.neighbor(pu.Point(-2.75, 0.25), 0.5))
+        self.assertIsNone(tree.neighbor(pu.Point(-2.75, 0.25), 0.5, shift=1))
+
+
+class CompactKDTreeTestCase(SimpleKDTreeTestCase):
+    kd_tree_cls = pu.CompactKDTree
+
+    def test_repeated_points(self):
+        points = [pu.Point(1, 2)] * 3 + [pu.Point(1, 3), pu.Point(0, 2)] * 2
+        tree = self.kd_tree_cls(*points)
+        self.assertEqual(len(tree), 7)
+        for _ in range(3):
+            self.assertEqual(tree.neighbor(pu.Point(1.2, 2), 0.5, closed=False),
+                             pu.Point(1, 2))
+            tree.delete(pu.Point(1, 2))
+        self.assertIsNone(tree.neighbor(pu.Point(1.2, 2), 0.5, closed=False))
+        with self.assertRaises(KeyError):
+            tree.delete(pu.Point(1, 2))
+        self.assertEqual(tree.neighbor(pu.Point(1.2, 2), 1, closed=True), pu.Point(1, 3))
+        self.assertEqual(sorted(tree), sorted(points[3:]))
+        tree.restore_deleted()
+        self.assertEqual(sorted(tree), sorted(points))
+
+    def test_empty_tree(self):
+        tree = self.kd_tree_cls()
+        self.assertEqual(len(tree), 0)
+        self.assertIsNone(tree.neighbor(pu.Point(1, 2), 10))
+
+
+class RangeTreeTestCase(CompactKDTreeTestCase):
+    kd_tree_cls = pu.RangeTree
+
+
 class MultiEfratKDTreeTestCase(unittest.TestCase, EfratTestCaseMixin):
     efrat_cls = pu.MultiEfratKDTree
 
+class SimpleMultiEfratKDTreeTestCase(unittest.TestCase, EfratTestCaseMixin):
+    class efrat_cls(pu.MultiEfratKDTree):
+        kd_tree_cls = pu.SimpleKDTree
+
 class EfratTreeWithDiagonalTestCase(unittest.TestCase, EfratTestCaseMixin):
     efrat_cls = pu.EfratTreeWithDiagonal
 
@@ -237,6 +339,25 @@ class EfratTreeWithDiagonalTestCase(unittest.TestCase, EfratTestCaseMixin):
                                other_diag="other", closed=True)
         self.assertEqual(efrat.neighbor("other"), points[1])
 
+    def test_reset_with_diagonal(self):
+        points = [pu.Point(1, 3), pu.Point(1, 10)]
+        efrat = self.efrat_cls(*(points * 2), "diag", radius=1.5, diag_key="diag",
+                               other_diag="other", closed=True)
+        while efrat.neighbor("other") is not None:
+            efrat.delete(efrat.neighbor("other"))
+        efrat.reset()
+        self.assertEqual(efrat.count("diag"), 1)
+        self.assertEqual(efrat.count(points[0]), 2)
+        efrat.delete("diag")
+        self.assertEqual(efrat.neighbor("other"), points[0])
+        efrat.reset(radius=0.5)
+        efrat.delete("diag")
+        self.assertIsNone(efrat.neighbor("other"))
+        efrat.reset(radius=5)
+        efrat.delete("diag")
+        efrat.delete(points[0], mult=-1)
+        self.assertEqual(efrat.neighbor("other"), points[1])
+
     def test_empty_except_diagonal(self):
         efrat = self.efrat_cls("diag", "diag", "diag",
                                diag_key="diag", other_diag="other")
@@ -245,5 +366,35 @@ class EfratTreeWithDiagonalTestCase(unittest.TestCase, EfratTestCaseMixin):
 
 
 
+class EfratRangeTreeTestCase(EfratTreeWithDiagonalTestCase):
+    efrat_cls = pu.EfratRangeTree
+
+
+class GridEfratStructureTestCase(EfratTreeWithDiagonalTestCase):
+    efrat_cls = pu.GridEfratStructure
+
+    def test_near_duplicate_points(self):
+        points = [pu.Point(1 + i * 1e-9, 2) for i in range(50)] + [pu.Point(3, 3.5)]
+        efrat = self.efrat_cls(*points, radius=0.5, closed=False)
+        found = []
+        while efrat.neighbor(pu.Point(1.2, 2.2)) is not None:
+            found.append(efrat.neighbor(pu.Point(1.2, 2.2)))
+            efrat.delete(found[-1])
+        self.assertEqual(sorted(found), sorted(points[:-1]))
+        efrat.reset(radius=2)
+        self.assertEqual(efrat.neighbor(pu.Point(4.9, 3)), pu.Point(3, 3.5))
+        self.assertIsNone(efrat.neighbor(pu.Point(5.1, 3)))
+        efrat.reset(radius=math.inf)
+        self.assertIsNotNone(efrat.neighbor(pu.Point(100, -100)))
+        efrat.reset(radius=0, closed=True)
+        self.assertEqual(efrat.neighbor(pu.Point(3, 3.5)), pu.Point(3, 3.5))
+        self.assertIsNone(efrat.neighbor(pu.Point(3, 3.6)))
+
+
+class HashGridTestCase(CompactKDTreeTestCase):
+    def kd_tree_cls(self, *points):
+        return pu.HashGrid(points, 0.75)
+
+
 if __name__ == "__main__":
     unittest.main()
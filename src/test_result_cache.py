@@ -0,0 +1,81 @@
+import fractions
+import os
+import tempfile
+import unittest
+
+import main_algorithm as main
+import plane_util as pu
+import result_cache as rc
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+        self.A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8)]]
+        self.B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_canonical_hash(self):
+        self.assertEqual(rc.diagram_hash(self.A), rc.diagram_hash(list(reversed(self.A))))
+        self.assertEqual(rc.diagram_hash(self.A),
+                         rc.diagram_hash({pu.Point(1.0, 4.0): 2, pu.Point(3, 8): 1,
+                                          pu.Point(fractions.Fraction(4), 7): 1}))
+        self.assertNotEqual(rc.diagram_hash(self.A), rc.diagram_hash(self.A[1:]))
+        self.assertEqual(rc.pair_key(self.A, self.B), rc.pair_key(self.B, self.A))
+        self.assertNotEqual(rc.pair_key(self.A, self.B),
+                            rc.pair_key(self.A, self.B, algorithm="exact"))
+
+    def test_hits_and_misses(self):
+        with rc.ResultCache(self.path) as cache:
+            self.assertAlmostEqual(cache.distance(self.A, self.B), 1.5)
+            self.assertEqual(cache.distance(self.B, self.A),
+                             main.other_shifted_bottleneck_distance(self.A, self.B))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with rc.ResultCache(self.path) as cache:
+            self.assertEqual(len(cache), 1)
+            cache.distance(self.A, self.B)
+            cache.distance(self.A, self.B, algorithm="exact")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            cache.clear()
+            self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        with rc.ResultCache(self.path, max_entries=2) as cache:
+            for key in "abc":
+                cache.put(key, 1)
+                cache.get("a")  # keep "a" in use
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get("b"))
+            self.assertEqual(cache.get("a"), 1)
+            self.assertEqual(cache.get("c"), 1)
+        with rc.ResultCache(self.path, max_entries=10) as cache:
+            cache.clear()
+            for key in range(11):
+                cache.put(str(key), key)
+            # evicted down to 90% in one go
+            self.assertEqual(len(cache), 9)
+            self.assertIsNone(cache.get("1"))
+            self.assertEqual(cache.get("2"), 2)
+
+    def test_shared_between_processes(self):
+        first = rc.ResultCache(self.path, max_entries=3, touch_batch=2)
+        second = rc.ResultCache(self.path, max_entries=3)
+        first.put("a", 1)
+        first.put("b", 2)
+        second.put("c", 3)
+        first.get("a")
+        first.get("a")  # written back: "b" is now the oldest
+        second.put("d", 4)
+        self.assertEqual(len(first), 3)
+        self.assertIsNone(first.get("b"))
+        self.assertEqual([second.get(key) for key in "acd"], [1, 3, 4])
+        first.close()
+        second.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
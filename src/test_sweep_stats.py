@@ -0,0 +1,64 @@
+import contextlib
+import io
+import unittest
+
+import bipartite_matching as bpm
+import main_algorithm as main
+import plane_util as pu
+import sweep_stats
+
+
+class SweepStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.A = [pu.Point(x, y) for x, y in [(0, 2)] * 30 + [(10, 20)] * 4]
+        self.B = [pu.Point(x, y) for x, y in [(100, 104)] * 4 + [(50, 52)] * 20]
+
+    def assert_consistent(self, stats):
+        self.assertEqual(stats.events, stats.exit_events + stats.entry_events)
+        self.assertGreater(stats.matchings, 0)
+        self.assertGreaterEqual(stats.augmenting_paths, stats.phases)
+        self.assertGreaterEqual(stats.path_edges, stats.augmenting_paths)
+        self.assertGreater(stats.neighbor_queries, 0)
+        self.assertGreaterEqual(stats.time["sweep"], stats.time["matching"])
+        exported = stats.as_dict()
+        self.assertEqual(exported["events"], stats.events)
+        self.assertEqual(exported["time_setup"], stats.time["setup"])
+
+    def test_other_shifted_bottleneck_distance(self):
+        stats = sweep_stats.SweepStats()
+        self.assertEqual(main.other_shifted_bottleneck_distance(self.A, self.B, stats=stats),
+                         main.other_shifted_bottleneck_distance(self.A, self.B))
+        self.assert_consistent(stats)
+        # one structure over all of B, reset rather than rebuilt, and at
+        # least one per phase over the points of B in its odd layers
+        self.assertGreaterEqual(stats.tree_builds, stats.phases + 1)
+
+    def test_shifted_bottleneck_distance(self):
+        stats = sweep_stats.SweepStats()
+        main.shifted_bottleneck_distance(self.A, self.B, stats=stats)
+        self.assert_consistent(stats)
+
+    def test_disabled(self):
+        matching = bpm.GeometricBipartiteMatching(self.A, self.B)
+        self.assertIs(matching.efrat_cls, bpm.GeometricBipartiteMatching.efrat_cls)
+        stats = sweep_stats.SweepStats()
+        matching = bpm.GeometricBipartiteMatching(self.A, self.B, stats=stats)
+        self.assertTrue(issubclass(matching.efrat_cls, bpm.GeometricBipartiteMatching.efrat_cls))
+        self.assertIs(stats.counting(pu.EfratTreeWithDiagonal), matching.efrat_cls)
+
+    def test_deprecated_analysis(self):
+        stats = sweep_stats.SweepStats()
+        out = io.StringIO()
+        for _ in range(2):
+            with self.assertWarns(DeprecationWarning), contextlib.redirect_stdout(out):
+                main.other_shifted_bottleneck_distance(self.A, self.B, analysis=True,
+                                                       stats=stats)
+        # each line has that call's counts, not the running totals
+        first, second = (line.split() for line in out.getvalue().splitlines())
+        self.assertEqual(first, second)
+        self.assertEqual(first[:4], ["other:", "4", "total", str(stats.events // 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from fractions import Fraction
+
+import main_algorithm as main
+import plane_util as pu
+import sweep_stats
+import sweep_trace as st
+
+
+class SweepTraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.A = [pu.Point(x, y) for x, y in [(1, 4), (1, 4), (4, 7), (3, 8), (0, 0.5)]]
+        self.B = [pu.Point(x, y) for x, y in [(2, 5), (3, 6), (3, 7)]]
+
+    def record(self, algorithm="paper"):
+        trace = st.SweepTrace()
+        main.ALGORITHMS[algorithm](self.A, self.B, trace=trace)
+        return trace.buffer
+
+    def test_records(self):
+        stats = sweep_stats.SweepStats()
+        trace = st.SweepTrace()
+        distance = main.other_shifted_bottleneck_distance(self.A, self.B, stats=stats,
+                                                          trace=trace)
+        self.assertEqual(distance, main.other_shifted_bottleneck_distance(self.A, self.B))
+        trace = st.Trace(trace.buffer)
+        self.assertEqual(trace.algorithm, "paper")
+        self.assertEqual(trace.A, pu.SaneCounter(self.A))
+        self.assertEqual(trace.B, pu.SaneCounter(self.B))
+        self.assertEqual(trace.distance, distance)
+        summary = st.summarize(trace)
+        self.assertEqual(summary["exit_events"], stats.exit_events)
+        self.assertEqual(summary["entry_events"], stats.entry_events)
+        self.assertEqual(summary["matchings"], stats.matchings)
+        self.assertEqual(summary["points"], (5, 3))
+        self.assertLessEqual(summary["matching_time"], summary["time"])
+        times = [record.time for record in trace.records]
+        self.assertEqual(times, sorted(times))
+        for record in trace.records:
+            if isinstance(record, (st.ExitRecord, st.EntryRecord)):
+                a, b = trace.edge(record)
+                self.assertTrue(a is pu.A_DIAG or a in trace.A)
+                self.assertTrue(b is pu.B_DIAG or b in trace.B)
+
+    def test_replay(self):
+        for algorithm in main.ALGORITHMS:
+            trace = st.Trace(self.record(algorithm))
+            self.assertEqual(trace.algorithm, algorithm)
+            self.assertIsNone(st.first_difference(trace, st.replay(trace)))
+        trace = st.SweepTrace()
+        below = main.QueryDiagram(self.A).distance_below(self.B, 1.2, trace=trace)
+        trace = st.Trace(trace.buffer)
+        self.assertTrue(trace.below)
+        self.assertEqual(trace.distance, below)
+        self.assertIsNone(st.first_difference(trace, st.replay(trace)))
+
+    def test_settings(self):
+        for queue_cls in st.QUEUE_CLASSES:
+            trace = st.SweepTrace()
+            main.other_shifted_bottleneck_distance(self.A, self.B, fudge=main.no_fudge,
+                                                   queue_cls=queue_cls, trace=trace)
+            trace = st.Trace(trace.buffer)
+            self.assertEqual(trace.fudge, "no_fudge")
+            self.assertIs(trace.queue_cls, queue_cls)
+            self.assertEqual(trace.min_radius, main.epsilon)
+            self.assertIsNone(st.first_difference(trace, st.replay(trace)))
+        with self.assertRaises(ValueError):
+            main.other_shifted_bottleneck_distance(self.A, self.B, fudge=lambda r: r,
+                                                   trace=st.SweepTrace())
+
+    def test_exact_numbers(self):
+        A = [pu.Point(Fraction(1, 3), Fraction(7, 3)), pu.Point(0, Fraction(1, 10))]
+        B = [pu.Point(Fraction(2, 3), Fraction(13, 5))]
+        trace = st.SweepTrace()
+        distance = main.other_shifted_bottleneck_distance(A, B, exact=True, trace=trace)
+        trace = st.Trace(trace.buffer)
+        self.assertTrue(trace.exact_numbers)
+        self.assertEqual(trace.A, pu.SaneCounter(A))
+        self.assertEqual(trace.B, pu.SaneCounter(B))
+        self.assertEqual(trace.distance, float(distance))
+        self.assertIsNone(st.first_difference(trace, st.replay(trace)))
+        trace = st.SweepTrace()
+        main.other_shifted_bottleneck_distance([pu.Point(0.5, 1.25)], [pu.Point(0.25, 2.0)],
+                                               trace=trace)
+        self.assertFalse(st.Trace(trace.buffer).exact_numbers)
+
+    def test_first_difference(self):
+        buffer = self.record()
+        trace, other = st.Trace(buffer), st.Trace(buffer)
+        other.records[3] = other.records[3]._replace(radius=-1.0)
+        self.assertEqual(st.first_difference(trace, other), 3)
+        other.records = other.records[:3]
+        self.assertEqual(st.first_difference(trace, other), 3)
+
+    def test_file(self):
+        trace = st.SweepTrace()
+        main.shifted_bottleneck_distance(self.A, self.B, trace=trace)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "run.sbdtrace")
+            trace.save(path)
+            loaded = st.Trace.load(path)
+            self.assertEqual(st.cli(["replay", path]), 0)
+            with open(path, "wb") as f:
+                f.write(trace.buffer[:-3])
+            with self.assertRaises(st.SweepTraceError):
+                st.Trace.load(path)
+        self.assertEqual(loaded.algorithm, "original")
+        with self.assertRaises(st.SweepTraceError):
+            st.Trace(b"not a trace")
+
+
+if __name__ == "__main__":
+    unittest.main()